@@ -0,0 +1,126 @@
+"""
+
+Python Module of Functions
+------ ------ -- ---------
+
+Dependencies: numpy, collections, gaussian_hat, optimization_gd, instrument.
+-------------
+
+Description :
+-----------
+
+    Direct inversion of group delay to density profile, without a model
+    (Bottollier-Curtet). For O mode the distance from the plasma edge to
+    the cutoff of probe frequency F is
+
+        d(F) = (c / pi) * integral from 0 to F of tau(f) / sqrt(F^2 - f^2)
+
+    with tau the group delay from the edge (as given by EvalGD). Taking
+    tau linear between the measured frequencies, and the density linear
+    from the edge to the first one (no data there, tau goes as F^2), each
+    integral is exact and d = M . tau, with M a lower triangular matrix
+    that depends just on the frequencies. M is made once for each grid
+    and kept (the last MaxMatrices grids used), so an inversion is one
+    product of matrix and vector (about a millisecond).
+
+    Points after CrossCenter (the wave crossed the plasma) are left out.
+    The profile is valid while it grows to the center, so n_max is taken
+    extrapolating the density of the last points to the center by a
+    parabola in x (n = n_max - b x^2), never below the last one measured.
+    It can seed (p0) or check a model fit of fit_GD.
+
+Example to Use:
+------- -- ----
+
+    >>> import abel_inversion as ab
+    >>> pf, gd = M.EvalGD(70.0)
+    >>> res = ab.Invert(pf * 1E9, gd * 1E-9)    # Hz and seconds
+    >>> res['x'], res['n'], res['n_max']
+    >>> M.EvalGD(70.0, True, p0=res['guess'])   # fit from inversion
+    >>> G.MaxDensity()                  # n_max of each row of a gd_map
+
+Developed by: Alex Andriati - USP
+
+"""
+
+import numpy as np;
+from collections import OrderedDict;
+import gaussian_hat as gh;
+import optimization_gd as opt;
+import instrument as ins;
+
+c = 299792458.0;
+Tail = 10;          # last points extrapolated to n_max.
+MaxMatrices = 4;    # grids kept, the least recently used is dropped.
+_matrices = OrderedDict();  # inversion matrix of each frequency grid.
+
+def InversionMatrix(F):
+    """ Matrix M with d = M . tau, d (m) the distance of cutoff of each
+        frequency F (Hz, increasing) from the edge and tau (s) the group
+        delay at F. Kept for the last MaxMatrices grids. """
+    F = np.asarray(F, dtype=float);
+    key = F.tostring();
+    if key in _matrices:
+        M = _matrices.pop(key);
+        _matrices[key] = M;     # most recently used at the end.
+        return M;
+    # Nodes of linear tau: zero at f = 0, then the frequencies.
+    f = np.concatenate([[0.], F]);
+    lo = f[:-1][None, :];   # segment k from f[k] to f[k + 1].
+    hi = f[1:][None, :];
+    Fi = F[:, None];
+    inside = hi <= Fi * (1 + 1E-12);    # segments below each F.
+    root = lambda x: np.sqrt(np.clip(Fi**2 - x**2, 0, None));
+    ratio = lambda x: np.arcsin(np.clip(x / Fi, -1, 1));
+    # Primitives of 1 / sqrt(F^2 - f^2) and of f / sqrt(F^2 - f^2).
+    dI0 = np.where(inside, ratio(hi) - ratio(lo), 0.);
+    dI1 = np.where(inside, root(lo) - root(hi), 0.);
+    h = hi - lo;
+    left = (hi * dI0 - dI1) / h;    # weight of tau at f[k].
+    right = (dI1 - lo * dI0) / h;   # weight of tau at f[k + 1].
+    M = right.copy();
+    M[:, 1:] += left[:, 1:];
+    # Below the first frequency the density is taken linear (edge), so
+    # tau = tau[0] (f / F[0])^2, with primitive of f^2 / sqrt(F^2 - f^2).
+    M[:, 0] = (0.5 * F**2 * np.arcsin(F[0] / F)
+               - 0.5 * F[0] * np.sqrt(F**2 - F[0]**2)) / F[0]**2;
+    M *= c / np.pi;
+    _matrices[key] = M;
+    while len(_matrices) > MaxMatrices: _matrices.popitem(last=False);
+    return M;
+
+def ClearMatrices(): _matrices.clear();
+
+@ins.Timed('abel')
+def Invert(pf, gd, tail=None):
+    """ Density profile from group delay gd (s) at probe frequencies pf
+        (Hz). Return a python dictionary with keys:
+
+        F ------> frequencies used (Hz, before CrossCenter, increasing)
+        x ------> cutoff position of each one (m, from the center)
+        n ------> density at x (m^-3)
+        n_max --> center density extrapolated from the last 'tail' points
+        guess --> first guess (n0, alpha, A, s) of fit_GD from n_max
+    """
+    if tail is None: tail = Tail;
+    order = np.argsort(pf);
+    F = np.asarray(pf, dtype=float)[order];
+    tau = np.asarray(gd, dtype=float)[order];
+    keep = np.concatenate([[True], np.diff(F) > 0]);
+    F, tau = F[keep], tau[keep];
+    # Matrix of the first points is a block of the one of all points, so
+    # the cut of CrossCenter (other for each sweep) uses the same matrix.
+    M = InversionMatrix(F);
+    CC = opt.CrossCenter(tau);
+    if CC > 0: F, tau, M = F[:CC], tau[:CC], M[:CC, :CC];
+    x = gh.a - np.dot(M, tau);
+    n = gh.FrequencyToDensity(F);
+    # Parabola n = n_max - b x^2 over the last points.
+    k = min(tail, F.size);
+    if k >= 2:
+        b, n_max = np.polyfit(x[-k:]**2, n[-k:], 1);
+        n_max = max(n_max, n[-1]);
+    else: n_max = n[-1];
+    A = 0.5;    # hat of the usual guess of fit_GD.
+    guess = [n_max / (1 + A**2), 1.3, A, 0.3 * gh.a];
+    return {'F': F, 'x': x, 'n': n, 'n_max': n_max, 'guess': guess};
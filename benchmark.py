@@ -0,0 +1,186 @@
+"""
+
+Python Script
+------ ------
+
+Dependencies: numpy, json, synthetic_shot, signal_analyse, gaussian_hat,
+              spectrogram.
+-------------
+
+Execution: $ python benchmark.py results.json [previous.json|-] [repeat]
+----------
+
+    Timing of the main steps of the analysis over a synthetic shot, made
+    once in a temporary folder (synthetic_shot.py), so it runs without the
+    server. Each step is repeated 'repeat' times (default 5) and the best
+    and mean wall time are kept:
+
+    load_npy, load_lazy, load_rfz -> shot_data of the saved shot and read
+                                     all samples of its channels.
+    take_bf ------------------------> TakeBF without the spectra cache.
+    take_bf_cached -----------------> TakeBF one sweep later, with cache.
+    take_bf_zoom -------------------> TakeBF of engine 'zoom', no cache.
+    eval_gd ------------------------> EvalGD without fit.
+    opt_group_delay ----------------> gh.OptGroupDelay over EvalGD pf.
+    fit_gd -------------------------> full fit_GD (no figure saved).
+    take_bf_<peak> -----------------> TakeBF without padding, the peak
+                                      refined by parabolic or gaussian.
+
+    The accuracy of each peak method is also taken (PeakAccuracy): the
+    difference to TakeBF with argmax of zero padded spectra (the usual)
+    of beat frequency (kHz) and of group delay (ns) of EvalGD over
+    ACCURACY_TIMES, median and 90 percentile, and rms of group delay of
+    points fitted (before CrossCenter). Points after the cutoff have no
+    clear line and differ a lot, so the maximum is not a good measure.
+
+    Results go to a json file with the commit, versions and shot params.
+    Given a previous json the ratio of each step (new / old) is printed,
+    to compare regressions between commits ('-' for none).
+
+Developed by: Alex Andriati - USP
+
+"""
+
+import sys, os, time, json, shutil, tempfile, platform, subprocess;
+import numpy as np, scipy;
+import matplotlib; matplotlib.use('Agg'); # figures are never shown.
+import synthetic_shot as ss;
+import shot_data as sd;
+import signal_analyse as sa;
+import gaussian_hat as gh;
+import optimization_gd as opt;
+import spectrogram as sp;
+
+SHOT = dict(ms=14.0, noise=0.3, seed=0);
+TIME = 7.0;     # instant analysed (ms), with plasma.
+ACCURACY_TIMES = np.arange(5.5, 13.0, 0.5);
+
+def LoadShot(path, lazy=False):
+    """ shot_data of path reading every sample (lazy and rfz channels
+        are read just when accessed), so all loads do the same work. """
+    s = sd.shot_data(path, lazy);
+    for x in (s.K, s.KA, s.trig): x[:].sum();
+    return s;
+
+def Timing(func, repeat):
+    """ Call func 'repeat' times, return dict of best and mean time (s). """
+    times = [];
+    for i in range(repeat):
+        t = time.time();
+        func();
+        times.append(time.time() - t);
+    return {'best': min(times), 'mean': sum(times) / repeat,
+            'repeat': repeat};
+
+def Commit():
+    """ Current git commit of the package, or None. """
+    here = os.path.dirname(os.path.abspath(__file__));
+    try: return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                        cwd=here).strip();
+    except (OSError, subprocess.CalledProcessError): return None;
+
+def RunBenchmarks(repeat=5):
+    """ Return dict with the timing of each step (see module help). """
+    folder = tempfile.mkdtemp();
+    try:
+        shot = ss.SyntheticShot(**SHOT);
+        shot.SaveShot(folder);
+        path = folder + '/#' + str(shot.shot_number) + '/';
+        results = {};
+        results['load_npy'] = Timing(lambda: LoadShot(path), repeat);
+        results['load_lazy'] = Timing(lambda: LoadShot(path, True), repeat);
+        shot.SaveShot(folder, 'rfz');
+        results['load_rfz'] = Timing(lambda: LoadShot(path), repeat);
+        os.remove(path + 'shot.rfz');
+        M = sa.SF_analysis(path, Tvac=1, cache_mb=0);
+        results['take_bf'] = Timing(lambda: M.TakeBF(TIME), repeat);
+        Z = sa.SF_analysis(path, Tvac=1, cache_mb=0, engine='zoom');
+        results['take_bf_zoom'] = Timing(lambda: Z.TakeBF(TIME), repeat);
+        C = sa.SF_analysis(path, Tvac=1);
+        C.TakeBF(TIME);
+        # Each call one sweep later: one new sweep, the others cached.
+        later = iter(TIME + 0.01 * np.arange(1, repeat + 1));
+        results['take_bf_cached'] = Timing(lambda: C.TakeBF(next(later)),
+                                           repeat);
+        results['eval_gd'] = Timing(lambda: M.EvalGD(TIME), repeat);
+        pf, gd = M.EvalGD(TIME);
+        p = [1.0E19, 1.5, 0.6, 0.05];
+        results['opt_group_delay'] = Timing(lambda: gh.OptGroupDelay(
+                                            pf * 1E9, *p), repeat);
+        results['fit_gd'] = Timing(lambda: opt.fit_GD(pf * 1E9, gd * 1E-9,
+                                   TIME, saveIm=False), repeat);
+        for peak in sp.PEAKS[1:]:
+            P = sa.SF_analysis(path, Tvac=1, cache_mb=0, reference=None,
+                               peak=peak);
+            results['take_bf_' + peak] = Timing(lambda: P.TakeBF(TIME),
+                                                repeat);
+        accuracy = PeakAccuracy(path);
+    finally: shutil.rmtree(folder, ignore_errors=True);
+    return (results, accuracy);
+
+def PeakAccuracy(path, times=ACCURACY_TIMES):
+    """ Difference of each peak method (and of argmax without padding) to
+        the usual TakeBF, for the shot in path. Return a dict by method
+        with rms and max of beat frequency (kHz) and group delay (ns). """
+    ref = sa.SF_analysis(path, Tvac=1, cache_mb=0, reference=None);
+    accuracy = {};
+    for peak in sp.PEAKS:
+        M = sa.SF_analysis(path, Tvac=1, cache_mb=0, reference=None,
+                           peak=peak);
+        if peak == 'argmax': M.pad_to = M.nfft;     # no padding either.
+        M.spec = sp.BatchSpecgram(M.nfft, M.fft_step, M.SD.rate, M.pad_to);
+        M.vacBF = M.TakeBF(1);
+        dbf = []; dgd = []; fit = [];
+        for t in times:
+            dbf.append(np.abs(M.TakeBF(t) - ref.TakeBF(t)) / 1E3);
+            gd = ref.EvalGD(t)[1];
+            dgd.append(np.abs(M.EvalGD(t)[1] - gd));
+            CC = opt.CrossCenter(gd * 1E-9);
+            fit.append(dgd[-1][:CC] if CC > 0 else dgd[-1]);
+        dbf = np.concatenate(dbf); dgd = np.concatenate(dgd);
+        fit = np.concatenate(fit);
+        name = peak + '_pad%d' % M.pad_to;
+        accuracy[name] = {'bf_median_khz': np.median(dbf),
+                          'bf_p90_khz': np.percentile(dbf, 90),
+                          'gd_median_ns': np.median(dgd),
+                          'gd_p90_ns': np.percentile(dgd, 90),
+                          'gd_fit_rms_ns': np.sqrt(np.mean(fit**2))};
+    return accuracy;
+
+def Compare(new, old):
+    """ Print new / old time (best) of each step in both results. """
+    print '\n%-18s %10s %10s %8s' % ('step', 'old (s)', 'new (s)', 'ratio');
+    for name in sorted(new['results']):
+        if name not in old['results']: continue;
+        t_new = new['results'][name]['best'];
+        t_old = old['results'][name]['best'];
+        print '%-18s %10.4f %10.4f %8.2f' % (name, t_old, t_new,
+                                              t_new / t_old);
+
+if __name__ == '__main__':
+    output = sys.argv[1];
+    previous = sys.argv[2] if len(sys.argv) > 2 else '-';
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 5;
+    report = {'commit': Commit(),
+              'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'python': platform.python_version(),
+              'numpy': np.__version__, 'scipy': scipy.__version__,
+              'shot': SHOT, 'time': TIME,
+              'results': None, 'accuracy': None};
+    report['results'], report['accuracy'] = RunBenchmarks(repeat);
+    f = open(output, 'w');
+    json.dump(report, f, indent=2, sort_keys=True);
+    f.close();
+    for name in sorted(report['results']):
+        print '%-18s %10.4f s' % (name, report['results'][name]['best']);
+    print '\n%-18s %9s %9s %9s %9s %9s' % ('peak (diff)', 'bf med',
+          'bf p90', 'gd med', 'gd p90', 'fit rms');
+    for name in sorted(report['accuracy']):
+        a = report['accuracy'][name];
+        print '%-18s %5.1f kHz %5.1f kHz %6.4f ns %6.4f ns %6.4f ns' % (
+              name, a['bf_median_khz'], a['bf_p90_khz'], a['gd_median_ns'],
+              a['gd_p90_ns'], a['gd_fit_rms_ns']);
+    if previous != '-':
+        f = open(previous, 'r');
+        Compare(report, json.load(f));
+        f.close();
@@ -0,0 +1,297 @@
+"""
+
+PYTHON CLASS & MODULE
+------ ----- - ------
+
+Dependencies : os, numpy, scipy, shot_data, instrument.
+------------
+
+Description :
+-----------
+
+    Analysis of fixed frequency ('ff') and hopping frequency ('hf') shots,
+    the modes that SF_analysis doesnt take. The signal of each band (K and
+    KA, probe frequency 2 and 3 times the source) is demodulated to
+    amplitude and phase, and fluctuation spectra are taken from the complex
+    signal amplitude * exp(i phase).
+
+    These records are long and of high rate, so everything goes by chunks
+    of 'chunk' samples: each one is read (memory mapped when lazy), taken
+    with 'margin' samples more at both sides against edge effects of the
+    filters, demodulated and written in the output, that can be npy files
+    memory mapped in a folder. Phase is unwrapped across chunks.
+
+    Demodulation methods:
+
+    'hilbert' -> analytic signal of each chunk by FFT. The phase of the
+                 carrier (Hz, default 0 for signals in base band) is taken
+                 out.
+    'iq' ------> signal mixed with the carrier, exp(-2 pi i carrier t), and
+                 low pass filtered by a moving average of one carrier
+                 period. Without carrier given it is the peak of the
+                 spectrum of the first chunk.
+
+    Spectra are mean power of hanning windows of nfft points of the complex
+    signal, transformed in batches (all windows of a chunk in one FFT).
+
+    In hopping mode the source takes each frequency of the table freqs for
+    st us and starts again rt us after the last one; the record is taken as
+    starting with the first frequency (or 'offset' samples later). Hop
+    gives the mean amplitude and phase of each step.
+
+How to use :
+--- -- ---
+
+    >>> import fixed_analyse as fa
+    >>> M = fa.FF_analysis(shot_number)      # or path of a saved shot
+    >>> amp, phase = M.Demodulate('K', 60, 90)
+    >>> amp, phase = M.Demodulate('K', folder='/data/ff/')  # npy files
+    >>> f, S = M.Spectra('K', 60, 90, nfft=1024)
+    >>> t, f, S = M.Spectrogram('K', 60, 90, nfft=1024, average=16)
+    >>> steps = M.Hop('KA')                  # hf: {freq: (t, amp, phase)}
+
+DEVELOPED BY: ALEX ANDRIATI - USP
+
+"""
+
+import os;
+import numpy as np;
+import scipy.signal as signal, scipy.fftpack as fftpack;
+from numpy.lib.format import open_memmap;
+import shot_data as sd;
+import instrument as ins;
+
+BANDS = {'K': 2, 'KA': 3};  # multiplier of source frequency of each band.
+
+def MovingAverage(z, m):
+    """ Centered moving average of m points, edges keep the nearest. """
+    c = np.cumsum(np.concatenate([[0], z]));
+    y = (c[m:] - c[:-m]) / m;
+    out = np.empty(z.size, dtype=y.dtype);
+    out[m // 2:m // 2 + y.size] = y;
+    out[:m // 2] = y[0];
+    out[m // 2 + y.size:] = y[-1];
+    return out;
+
+class FF_analysis:
+    """ Amplitude, phase and fluctuation spectra of fixed or hopping
+        frequency shots. Type help of Demodulate, Spectrogram and Hop. """
+
+    def __init__(self, shot, path='', lazy=True, chunk=2**22, margin=2**12,
+                 method='hilbert', carrier=None):
+        """ Constructor. shot is a shot number, a path of a saved shot or
+            a shot_data alredy taken. path is the folder of results (as
+            in SF_analysis). chunk and margin are samples of each piece
+            processed and of its sides. method is 'hilbert' or 'iq' and
+            carrier its frequency in Hz (see module help). """
+        if hasattr(shot, 'mode'): self.SD = shot;   # data alredy taken.
+        else: self.SD = sd.shot_data(shot, lazy);
+        if self.SD.mode not in ('ff', 'hf'):
+            raise TypeError('Not a fixed or hopping frequency shot.');
+        if method not in ('hilbert', 'iq'):
+            raise ValueError('Unknow demodulation method ' + str(method));
+        if path != '': self.DefinePath(path);
+        else:          self.path = path;
+        self.chunk = chunk;
+        self.margin = margin;
+        self.method = method;
+        self.carrier = carrier;
+        self._carriers = {};
+
+    def DefinePath(self, folder):
+        """ Define a path on current computer to save data analysis. """
+        if not os.path.exists(folder): raise IOError('Folder Doesnt exist!');
+        if folder[-1] != '/': folder = folder + '/';
+        FullPath = folder + '#' + str(self.SD.shot_number) + '_results/';
+        try: os.mkdir(FullPath);
+        except OSError: print '\nCareful, alredy has an initiated analysis.';
+        self.path = FullPath;
+
+    def ProbeFreq(self, band='K'):
+        """ Probe frequency (GHz) of band, a table in hopping mode. """
+        source = self.SD.freq if self.SD.mode == 'ff' else self.SD.freqs;
+        return BANDS[band] * np.asarray(source);
+
+    def Carrier(self, band='K'):
+        """ Carrier frequency (Hz) removed by the demodulation of band. """
+        if self.carrier is not None: return float(self.carrier);
+        if self.method == 'hilbert': return 0.0;
+        if band not in self._carriers:
+            x = self.__Channel(band);
+            seg = np.asarray(x[:min(len(x), self.chunk)], dtype=float);
+            power = np.abs(np.fft.rfft(seg - seg.mean()))**2;
+            power[0] = 0;
+            self._carriers[band] = power.argmax() * self.SD.rate / seg.size;
+        return self._carriers[band];
+
+    def __Channel(self, band):
+        if band not in BANDS: raise ValueError('Unknow band ' + str(band));
+        return getattr(self.SD, band);
+
+    def __Range(self, band, t1, t2):
+        """ Sample range [i1, i2) of times t1 to t2 (ms) in the record. """
+        size = len(self.__Channel(band));
+        i1 = 0 if t1 is None else max(0, int(self.SD.rate * t1 * 1E-3));
+        i2 = size if t2 is None else min(size, int(self.SD.rate * t2 * 1E-3));
+        if i2 <= i1: raise ValueError('Empty time range.');
+        return (i1, i2);
+
+    def __Baseband(self, seg, start, carrier):
+        """ Complex signal of samples seg (first index start), carrier
+            taken out. """
+        seg = seg - seg.mean();
+        t = (start + np.arange(seg.size)) / self.SD.rate;
+        if self.method == 'hilbert':
+            z = signal.hilbert(seg, fftpack.next_fast_len(seg.size));
+            z = z[:seg.size];
+            if carrier != 0: z *= np.exp(-2j * np.pi * carrier * t);
+            return z;
+        if carrier <= 0: raise ValueError('IQ demodulation needs a carrier.');
+        z = 2 * seg * np.exp(-2j * np.pi * carrier * t);
+        return MovingAverage(z, max(1, int(round(self.SD.rate / carrier))));
+
+    def Chunks(self, band='K', t1=None, t2=None):
+        """ Yield (i1, z) for each chunk from t1 to t2 (ms), z the complex
+            signal (amplitude * exp(i phase)) from sample i1. """
+        x = self.__Channel(band);
+        i1, i2 = self.__Range(band, t1, t2);
+        carrier = self.Carrier(band);
+        for c1 in range(i1, i2, self.chunk):
+            c2 = min(c1 + self.chunk, i2);
+            a1 = max(0, c1 - self.margin);
+            a2 = min(len(x), c2 + self.margin);
+            with ins.Stage('demodulate'):
+                z = self.__Baseband(np.asarray(x[a1:a2], dtype=float), a1,
+                                    carrier);
+            yield (c1, z[c1 - a1:c2 - a1]);
+
+    def Demodulate(self, band='K', t1=None, t2=None, folder=None):
+        """ Call signature example: amp, phase = M.Demodulate('K', 60, 90)
+            --------------------------------------------------------------
+
+            Amplitude and phase (rad, unwrapped) of band from t1 to t2 (ms,
+            default whole record). With folder they are written there as
+            <band>_amplitude.npy and <band>_phase.npy and returned memory
+            mapped, so the record doesnt need to fit in memory. """
+        i1, i2 = self.__Range(band, t1, t2);
+        if folder is None:
+            amp = np.empty(i2 - i1);
+            phase = np.empty(i2 - i1);
+        else:
+            if not os.path.exists(folder): os.makedirs(folder);
+            name = os.path.join(folder, band + '_%s.npy');
+            amp = open_memmap(name % 'amplitude', 'w+', float, (i2 - i1,));
+            phase = open_memmap(name % 'phase', 'w+', float, (i2 - i1,));
+        last = None;
+        for c1, z in self.Chunks(band, t1, t2):
+            ph = np.angle(z);
+            # Continue from the last phase of the previous chunk.
+            if last is not None:
+                ph = np.unwrap(np.concatenate([[last], ph]))[1:];
+            else: ph = np.unwrap(ph);
+            amp[c1 - i1:c1 - i1 + z.size] = np.abs(z);
+            phase[c1 - i1:c1 - i1 + z.size] = ph;
+            last = ph[-1];
+        if folder is not None:
+            amp.flush();
+            phase.flush();
+        return (amp, phase);
+
+    def __WindowPower(self, band, t1, t2, nfft):
+        """ Yield the power (windows x nfft) of consecutive hanning windows
+            of nfft points from t1 (ms), all windows of a chunk in one FFT
+            (the samples left go with the next chunk). """
+        window = np.hanning(nfft);
+        rest = np.zeros(0, dtype=complex);
+        for c1, z in self.Chunks(band, t1, t2):
+            buf = np.concatenate([rest, z]);
+            nwin = buf.size // nfft;
+            W = buf[:nwin * nfft].reshape(nwin, nfft) * window;
+            yield np.abs(np.fft.fft(W, axis=1))**2;
+            rest = buf[nwin * nfft:];
+
+    def __Density(self, nfft):
+        """ Frequencies (Hz, negative first) and the scale of power to
+            power spectral density. """
+        f = np.fft.fftshift(np.fft.fftfreq(nfft, 1.0 / self.SD.rate));
+        return (f, 1.0 / (self.SD.rate * (np.hanning(nfft)**2).sum()));
+
+    @ins.Timed('fluctuation_spectra')
+    def Spectrogram(self, band='K', t1=None, t2=None, nfft=1024, average=16):
+        """ Call signature example: t, f, S = M.Spectrogram('K', 60, 90)
+            ------------------------------------------------------------
+
+            Power spectral density of the complex signal of band from t1 to
+            t2 (ms), each row the mean of 'average' consecutive windows of
+            nfft points. Return time of rows (ms, center), frequencies (Hz,
+            negative and positive) and S (rows x frequencies). """
+        f, scale = self.__Density(nfft);
+        rows = [];
+        acc = 0.; count = 0;
+        for P in self.__WindowPower(band, t1, t2, nfft):
+            k = 0;
+            while k < P.shape[0]:
+                take = min(average - count, P.shape[0] - k);
+                acc = acc + P[k:k + take].sum(axis=0);
+                count += take;
+                k += take;
+                if count == average:
+                    rows.append(acc * (scale / average));
+                    acc = 0.; count = 0;
+        S = np.fft.fftshift(np.array(rows).reshape(-1, nfft), axes=1);
+        i1 = self.__Range(band, t1, t2)[0];
+        centers = i1 + average * nfft * (np.arange(len(rows)) + 0.5);
+        return (self.SD.Time(centers), f, S);
+
+    @ins.Timed('fluctuation_spectra')
+    def Spectra(self, band='K', t1=None, t2=None, nfft=1024):
+        """ Mean power spectral density of all windows (see Spectrogram)
+            from t1 to t2 (ms). Return (f, S). """
+        f, scale = self.__Density(nfft);
+        acc = 0.; count = 0;
+        for P in self.__WindowPower(band, t1, t2, nfft):
+            acc = acc + P.sum(axis=0);
+            count += P.shape[0];
+        if count == 0: raise ValueError('Time range shorter than nfft.');
+        return (f, np.fft.fftshift(acc * (scale / count)));
+
+    @ins.Timed('hop')
+    def Hop(self, band='K', t1=None, t2=None, settle=0.2, offset=0):
+        """ Call signature example: steps = M.Hop('K')
+            ------------------------------------------
+
+            Mean complex signal of each step of the hopping table from t1
+            to t2 (ms), leaving the first 'settle' fraction of each step.
+            offset are samples from the record start to the first step.
+            Return a dictionary by probe frequency (GHz) of arrays (time of
+            steps in ms, amplitude, phase in rad). """
+        if self.SD.mode != 'hf': raise TypeError('Not a hopping shot.');
+        step = self.SD.Nsweep;
+        table = self.ProbeFreq(band);
+        period = 1E-6 * (table.size * self.SD.st + self.SD.rt) * self.SD.rate;
+        skip = int(settle * step);
+        i1, i2 = self.__Range(band, t1, t2);
+        # Steps inside the range: start of step j of cycle n.
+        n1 = max(0, int(np.floor((i1 - offset) / period)));
+        n2 = int(np.ceil((i2 - offset) / period));
+        n = np.arange(n1, n2 + 1);
+        starts = (offset + np.round(n[:, None] * period).astype(int)
+                  + step * np.arange(table.size)[None, :]);
+        inside = (starts >= i1) & (starts + step <= i2);
+        # Sum of z in [start + skip, start + step) of each step, the part
+        # inside each chunk by its cumulative sum (steps may cross chunks).
+        total = np.zeros(starts.shape, dtype=complex);
+        for c1, z in self.Chunks(band, t1, t2):
+            cs = np.concatenate([[0], np.cumsum(z)]);
+            lo = np.clip(starts + skip - c1, 0, z.size);
+            hi = np.clip(starts + step - c1, 0, z.size);
+            total += cs[hi] - cs[lo];
+        mean = total / (step - skip);
+        steps = {};
+        for j, freq in enumerate(table):
+            ok = inside[:, j];
+            steps[freq] = (self.SD.Time(starts[ok, j]), np.abs(mean[ok, j]),
+                           np.angle(mean[ok, j]));
+        return steps;
+
+    def SaveShot(self, path='', fmt='npy'): self.SD.SaveShot(path, fmt);
@@ -14,10 +14,18 @@
 
     This module try to fit a parabolic profile plus a gaussian, wich means
     that introduce a 'hat' in the center.
+
+    The group delay of a whole frequency array is evaluated at once by
+    GroupDelayArray with fixed order Gauss-Legendre quadrature. The old
+    point by point integration with quad is kept as OptGroupDelayQuad to
+    be the reference of CompareEngines. In the same quadrature pass the
+    derivatives over (n0, alpha, A, s) can be taken (OptJacobian), that is
+    the jac used by optimization_gd.fit_GD.
 """
 
 import numpy as np, scipy.optimize as opt, scipy.integrate as integ
 import parabolic_profile as pp
+import instrument as ins
 
 # Useful constants
 # ------ ---------
@@ -26,6 +34,15 @@ a = 0.18; Rwall = 0.225; # plasma chamber dimensions (TCABR).
 epslon_o = 8.854187817E-12; e = 1.6021766E-19; 
 c = 299792458; me = 9.109389E-31
 
+# Vectorized engine settings
+# ---------- ------ --------
+
+QuadOrder = 48;     # number of Gauss-Legendre nodes per integral.
+QuadRtol  = 1E-4;   # accepted relative deviation from quad reference.
+UseQuad   = False;  # True to go back to point by point integration.
+_nodes    = {};     # cache of nodes and weights mapped to [0, 1].
+_cutoff   = [None, None];   # last (key, xc) of CutoffArray.
+
 # Functions
 # ---------
 
@@ -42,6 +59,24 @@ def Profile(x, alpha, A, s):
     if (abs(x) >= a): return 0;
     return (1 - (x/a)**2)**alpha + (A**2) * np.exp(-(x / s)**2);
 
+def ProfileArray(x, alpha, A, s):
+    """ Same as Profile but for any array x at once. """
+    base = np.clip(1 - (x/a)**2, 0, None);
+    prof = base**alpha + (A**2) * np.exp(-(x / s)**2);
+    return np.where(np.abs(x) >= a, 0., prof);
+
+def ProfileDerivatives(x, alpha, A, s):
+    """ Return derivatives of Profile over (x, alpha, A, s) for any
+    array x. All of them are zero for |x| >= a. """
+    inside = np.abs(x) < a;
+    base = np.where(inside, 1 - (x/a)**2, 1.0);
+    gauss = np.exp(-(x / s)**2);
+    d_x = -2 * x * (alpha * base**(alpha - 1) / a**2 + (A**2) * gauss / s**2);
+    d_alpha = base**alpha * np.log(base);
+    d_A = 2 * A * gauss;
+    d_s = 2 * (A**2) * gauss * x**2 / s**3;
+    return [np.where(inside, d, 0.) for d in (d_x, d_alpha, d_A, d_s)];
+
 def Opt_X_root(x, alpha, A, s, frac):
     """ To find numerically the cut off position. """
     return Profile(x, alpha, A, s) - frac;
@@ -56,8 +91,50 @@ def FrequencyToX(frac, alpha, A, s):
     f_inf = Opt_X_root(0, alpha, A, s, frac);
     f_sup = Opt_X_root(a, alpha, A, s, frac);
     if (not ChangedSignal(f_sup, f_inf)): return a;
+    ins.Count('brentq');
     return opt.brentq(Opt_X_root, 0, a, args=(alpha, A, s, frac));
 
+def FrequencyToXArray(frac, alpha, A, s, xtol=2E-12, maxiter=100):
+    """ Same as FrequencyToX for an array of density ratios at once.
+    Roots are found by Newton steps safeguarded by bisection: each point
+    keeps a bracket [lo, hi] and a step that leaves it is replaced by the
+    middle point. Where there is no change of signal return a. """
+    frac = np.asarray(frac, dtype=float);
+    r = frac.ravel();
+    xc = a * np.ones(r.size);
+    f_inf = (1 + A**2) - r;         # Opt_X_root(0, ...)
+    f_sup = -r;                     # Opt_X_root(a, ...)
+    changed = np.where(f_inf * f_sup < 0)[0];
+    if changed.size == 0: return xc.reshape(frac.shape);
+    r = r[changed];
+    lo = np.zeros(r.size);
+    hi = a * np.ones(r.size);
+    # Initial guess from the parabolic part only.
+    x = a * np.sqrt(np.clip(1 - (r / (1 + A**2))**(1.0 / alpha), 0, 1));
+    x = np.clip(x, 0.01 * a, 0.99 * a);
+    active = np.arange(r.size);
+    for it in range(maxiter):
+        ins.Count('root_iterations');
+        xa = x[active];
+        f = ProfileArray(xa, alpha, A, s) - r[active];
+        d = ProfileDerivatives(xa, alpha, A, s)[0];
+        # Profile decreases with x, f > 0 means root at right.
+        right = f > 0;
+        lo[active[right]] = xa[right];
+        hi[active[~right]] = xa[~right];
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xn = xa - f / d;
+        la = lo[active]; ha = hi[active];
+        bad = ~np.isfinite(xn) | (xn <= la) | (xn >= ha);
+        xn[bad] = 0.5 * (la + ha)[bad];
+        xn[f == 0] = xa[f == 0];
+        x[active] = xn;
+        done = (np.abs(xn - xa) < xtol) | (f == 0) | (ha - la < xtol);
+        active = active[~done];
+        if active.size == 0: break;
+    xc[changed] = x;
+    return xc.reshape(frac.shape);
+
 def Func(x, alpha, A, s, r):
     """ Function to numerically integrate for Group Delay. """
     return 1.0 / np.sqrt(1.0 - Profile(x, alpha, A, s) / r );
@@ -67,6 +144,7 @@ def ProfileInt (xc, alpha, A, s, r) :
     gauss quadrature. If xc < 0 or boolean means that has no
     reflection point in plasma (nc > n_max). """
     if (xc > (0.995) * a): return 0; # tolerance.
+    ins.Count('quad');
     if (xc > 0):
         return integ.quad(Func, xc, a, args=(alpha, A, s, r),
                 epsrel=1.0e-3)[0];
@@ -74,10 +152,121 @@ def ProfileInt (xc, alpha, A, s, r) :
         return integ.quad(Func, -a, a, args=(alpha, A, s, r), 
                 epsrel=1.0e-3)[0];
 
+def GaussNodes(order):
+    """ Gauss-Legendre nodes and weights mapped to [0, 1]. """
+    if order not in _nodes:
+        u, w = np.polynomial.legendre.leggauss(order);
+        _nodes[order] = (0.5 * (u + 1), 0.5 * w);
+    return _nodes[order];
+
+def CutoffArray(r, alpha, A, s):
+    """ Critic position for each density ratio in r. Zero where
+    the wave cross the plasma (r >= 1 + A^2).
+    The last result is kept, so the jac call that follows the model
+    call at the same parameters doesnt solve the roots again. """
+    key = (alpha, A, s, r.tostring());
+    if _cutoff[0] == key: return _cutoff[1];
+    xc = np.zeros(r.shape);
+    cut = r < 1 + A**2;
+    xc[cut] = np.abs(FrequencyToXArray(r[cut], alpha, A, s));
+    _cutoff[0] = key; _cutoff[1] = xc;
+    return xc;
+
+def GroupDelayArray(F, n0, alpha, A, s, order=None, jac=False):
+    """ Group Delay for all frequencies F at once. Each integral from
+    xc to a is taken with fixed order Gauss-Legendre quadrature after the
+    change of variables x = xc + (a - xc) u^2, that removes the 1/sqrt
+    singularity at the cutoff. When there is no cutoff the integral over
+    the diameter is taken as twice the integral from 0 to a.
+
+    If jac is True return also the derivatives over (n0, alpha, A, s),
+    in a (F.size, 4) array, by derivation under the integral on u with
+    the same nodes. The cutoff moves with the parameters, as given by
+    d(xc) = (dr - dP) / P_x at xc, and the two parts cancel the 1/g^3/2
+    singularity, so the derivative integrand stays finite at u = 0. """
+    if order is None: order = QuadOrder;
+    u, w = GaussNodes(order);
+    r = np.ravel(FrequencyToDensity(F) / n0).astype(float);
+    xc = CutoffArray(r, alpha, A, s);
+    cross = xc <= 0;
+    zero = xc > 0.995 * a;  # tolerance.
+    L = a - xc;
+    x = xc[:, None] + L[:, None] * u**2;
+    P = ProfileArray(x, alpha, A, s);
+    g = 1.0 - P / r[:, None];
+    g = np.clip(g, 1E-300, None);   # round off right at the cutoff.
+    integral = L * np.dot(2 * u / np.sqrt(g), w);
+    integral[cross] *= 2;
+    groupDelay = 2 * integral / c;
+    groupDelay[cross] += 2 * (Rwall - a) / c; # add vaccum part.
+    groupDelay[zero] = 0;
+    groupDelay = groupDelay.reshape(np.shape(F));
+    if not jac: return groupDelay;
+
+    # Partial derivatives of g at fixed x and of the profile at xc.
+    P_x, P_alpha, P_A, P_s = ProfileDerivatives(x, alpha, A, s);
+    c_x, c_alpha, c_A, c_s = ProfileDerivatives(xc, alpha, A, s);
+    c_x = np.where(cross | zero, 1.0, c_x);
+    g_theta = [-P / (r[:, None] * n0), -P_alpha / r[:, None],
+               -P_A / r[:, None], -P_s / r[:, None]];
+    xc_theta = [-r / n0 / c_x, -c_alpha / c_x, -c_A / c_x, -c_s / c_x];
+    g_x = -P_x / r[:, None];
+    jacobian = np.zeros([r.size, 4]);
+    for k in range(4):
+        dxc = np.where(cross | zero, 0., xc_theta[k]);
+        dg = g_theta[k] + g_x * dxc[:, None] * (1 - u**2);
+        d_int = -dxc[:, None] / np.sqrt(g) - 0.5 * L[:, None] * dg / g**1.5;
+        jacobian[:, k] = 2 * np.dot(2 * u * d_int, w) / c;
+    jacobian[cross] *= 2;
+    jacobian[zero] = 0;
+    return (groupDelay, jacobian);
+
+def CompareEngines(F, n0, alpha, A, s, rtol=None, order=None):
+    """ Return (maximum relative deviation, True if below rtol) of
+    GroupDelayArray against the point by point quad reference. """
+    if rtol is None: rtol = QuadRtol;
+    ref = OptGroupDelayQuad(F, n0, alpha, A, s);
+    new = GroupDelayArray(F, n0, alpha, A, s, order);
+    scale = np.where(ref != 0, np.abs(ref), 1E-9);
+    dev = np.max(np.abs(new - ref) / scale);
+    return (dev, dev <= rtol);
+
 def OptGroupDelay (F, n0, alpha, A, s) :
     """ Function to be optimized, or to theorical curve of
     Group Delay based on the declared Profile above. 
-    avoid alpha < 0 and if s = 0 return just parabolic form. """
+    avoid alpha < 0 and if s = 0 return just parabolic form.
+    Set UseQuad = True to use the point by point reference. """
+    ins.Count('model_evals');
+    ins.Count('model_points', np.size(F));
+    if (alpha <= 0) :
+        groupDelay = np.zeros(F.size);
+        groupDelay = groupDelay.reshape(F.shape);
+        return groupDelay;
+    if (s == 0): return pp.OptGroupDelay(F, n0, alpha);
+    if UseQuad: return OptGroupDelayQuad(F, n0, alpha, A, s);
+    return GroupDelayArray(F, n0, alpha, A, s);
+
+def OptJacobian (F, n0, alpha, A, s) :
+    """ Derivatives of OptGroupDelay over (n0, alpha, A, s) with shape
+    (F.size, 4), to be given as jac of curve_fit. For s = 0 (parabolic
+    form) the derivatives are taken by forward differences. """
+    ins.Count('jacobian_evals');
+    if (alpha <= 0): return np.zeros([np.size(F), 4]);
+    if (s == 0 or UseQuad):
+        # A and s do nothing in the parabolic form.
+        p = np.array([n0, alpha, A, s], dtype=float);
+        f0 = np.ravel(OptGroupDelay(F, *p));
+        jacobian = np.zeros([f0.size, 4]);
+        for k in range(2 if s == 0 else 4):
+            h = 1.5E-8 * max(abs(p[k]), 1.0);
+            dp = p.copy(); dp[k] += h;
+            jacobian[:, k] = (np.ravel(OptGroupDelay(F, *dp)) - f0) / h;
+        return jacobian;
+    return GroupDelayArray(F, n0, alpha, A, s, jac=True)[1];
+
+def OptGroupDelayQuad (F, n0, alpha, A, s) :
+    """ Point by point version of OptGroupDelay with brentq and
+    adaptive quad for each frequency. Slow, kept as reference. """
     if (alpha <= 0) :
         groupDelay = np.zeros(F.size);
         groupDelay = groupDelay.reshape(F.shape);
@@ -0,0 +1,168 @@
+"""
+
+PYTHON CLASS & MODULE
+------ ----- - ------
+
+Dependencies : os, numpy, matplotlib, optimization_gd, abel_inversion,
+               render.
+------------
+
+    Group delay of a whole shot (instant x probe frequency), as made by
+    SF_analysis.GroupDelayMap, kept in a folder of npy files:
+
+    time.npy --> instant of each row (ms), start of its sweeps.
+    PF.npy ----> probe frequencies of beat frequency (GHz), both bands.
+    pf.npy ----> good probe frequencies of group delay (GHz).
+    bf.npy ----> beat frequency (Hz), rows x PF.
+    gd.npy ----> group delay (ns), rows x pf. NaN if not taken.
+    info.dat --> shot number.
+
+    The big arrays are memory mapped, so a map of a long shot is opened
+    at once and just the rows used are read. Fits, figures and exports
+    take the group delay from the map, without spectra again.
+
+HOW TO USE :
+------------
+
+    >>> import gd_map as gm
+    >>> G = gm.GroupDelayMap('/results/#31877_results/gd_map/')
+    >>> pf, gd = G.At(70.0)                 # nearest row, like EvalGD
+    >>> result = G.Fit(70.0)                # optimization_gd.fit_GD
+    >>> profile = G.Invert(70.0)            # abel_inversion, no model
+    >>> n_max = G.MaxDensity()              # inversion of every row
+    >>> G.Plot('map.png')
+    >>> G.Export('map.txt')
+
+Developed by: Alex Andriati - USP.
+
+"""
+
+import os;
+import numpy as np;
+from numpy.lib.format import open_memmap;
+import matplotlib.pyplot as plt;
+import optimization_gd as opt;
+import abel_inversion as ab;
+import render;
+
+def CreateMap(folder, time, PF, pf, shot_number):
+    """ Make the files of a map with len(time) rows filled with NaN and
+        return it opened to be written. """
+    if not os.path.exists(folder): os.makedirs(folder);
+    if folder[-1] != '/': folder = folder + '/';
+    np.save(folder + 'time.npy', np.asarray(time, dtype=float));
+    np.save(folder + 'PF.npy', np.asarray(PF, dtype=float));
+    np.save(folder + 'pf.npy', np.asarray(pf, dtype=float));
+    for name, axis in [('bf', PF), ('gd', pf)]:
+        data = open_memmap(folder + name + '.npy', 'w+', float,
+                           (len(time), len(axis)));
+        data[:] = np.nan;
+        del data;
+    finfo = open(folder + 'info.dat', 'w');
+    finfo.write('shot:%d\n' % shot_number);
+    finfo.close();
+    return GroupDelayMap(folder, 'r+');
+
+def DrawMap(time, pf, gd, shot_number, figName=None, show=False):
+    """ Image of group delay (ns) in time and probe frequency. Called
+        through render.Draw (in background if a queue was started). """
+    fig = plt.figure(figsize=(16, 9));
+    plt.imshow(gd.T, origin='lower', aspect='auto',
+               extent=[time[0], time[-1], pf[0], pf[-1]]);
+    plt.colorbar().set_label('Group Delay (ns)', fontsize=16);
+    plt.xlabel('Time (ms)', fontsize=16);
+    plt.ylabel('Probe Frequency (GHz)', fontsize=16);
+    plt.title('#%d' % shot_number, fontsize=16);
+    if figName is not None:
+        fig.savefig(figName, dpi=150, bbox_inches='tight');
+    if (show): plt.show(fig);
+    else:      plt.close(fig);
+
+class GroupDelayMap:
+    """ Group delay map in folder (see module help). mode is the one of
+        numpy memory map: 'r' read only, 'r+' to change it. """
+
+    def __init__(self, folder, mode='r'):
+        if folder[-1] != '/': folder = folder + '/';
+        if not os.path.isfile(folder + 'gd.npy'):
+            raise IOError('No group delay map in ' + folder);
+        self.folder = folder;
+        self.time = np.load(folder + 'time.npy');
+        self.PF = np.load(folder + 'PF.npy');
+        self.pf = np.load(folder + 'pf.npy');
+        self.bf = np.load(folder + 'bf.npy', mmap_mode=mode);
+        self.gd = np.load(folder + 'gd.npy', mmap_mode=mode);
+        self.shot_number = 11111;
+        finfo = open(folder + 'info.dat', 'r');
+        for line in finfo.read().splitlines():
+            key, value = line.split(':');
+            if key == 'shot': self.shot_number = int(value);
+        finfo.close();
+
+    def __len__(self): return self.time.size;
+
+    def Flush(self):
+        """ Write changes of the memory maps to disk. """
+        self.bf.flush();
+        self.gd.flush();
+
+    def Index(self, t):
+        """ Row of instant nearest to t (ms). """
+        return int(np.abs(self.time - t).argmin());
+
+    def At(self, t):
+        """ (pf, GD) of the row nearest to t (ms), like EvalGD. """
+        return (self.pf, np.array(self.gd[self.Index(t)]));
+
+    def Fit(self, t, path='', show=False, saveIm=False, p0=None):
+        """ fit_GD of the row nearest to t (ms). RuntimeError if the row
+            was not taken. """
+        row = self.Index(t);
+        gd = np.array(self.gd[row]);
+        if not np.isfinite(gd).all():
+            raise RuntimeError('No group delay at %.3f ms' % self.time[row]);
+        return opt.fit_GD(self.pf * 1E9, gd * 1E-9, self.time[row], path,
+                          show, saveIm, p0=p0);
+
+    def Invert(self, t):
+        """ abel_inversion.Invert of the row nearest to t (ms), None if the
+            row was not taken. """
+        gd = np.array(self.gd[self.Index(t)]);
+        if not np.isfinite(gd).all(): return None;
+        return ab.Invert(self.pf * 1E9, gd * 1E-9);
+
+    def MaxDensity(self, t1=None, t2=None, rows=1024):
+        """ n_max (m^-3) of abel_inversion of each row from t1 to t2 (ms),
+            NaN where not taken. Rows are read by blocks. """
+        i1 = 0 if t1 is None else self.Index(t1);
+        i2 = len(self) if t2 is None else self.Index(t2) + 1;
+        n_max = np.empty(i2 - i1) * np.nan;
+        for r1 in range(i1, i2, rows):
+            block = np.array(self.gd[r1:min(r1 + rows, i2)]);
+            for k, gd in enumerate(block):
+                if not np.isfinite(gd).all(): continue;
+                n_max[r1 - i1 + k] = ab.Invert(self.pf * 1E9,
+                                               gd * 1E-9)['n_max'];
+        return n_max;
+
+    def Plot(self, figName=None, show=False, t1=None, t2=None):
+        """ Image of the map (from t1 to t2 ms), saved in figName. """
+        i1 = 0 if t1 is None else self.Index(t1);
+        i2 = len(self) if t2 is None else self.Index(t2) + 1;
+        render.Draw(DrawMap, self.time[i1:i2], self.pf,
+                    np.array(self.gd[i1:i2]), self.shot_number, figName,
+                    show=show);
+
+    def Export(self, fileName, rows=1024):
+        """ Text file with pf (GHz) in the first line and then time (ms)
+            and group delay (ns) of each row, written by blocks of rows. """
+        f = open(fileName, 'w');
+        f.write('# shot %d: first line pf (GHz), others time (ms) and '
+                'group delay (ns)\n' % self.shot_number);
+        np.savetxt(f, np.concatenate([[np.nan], self.pf])[None, :],
+                   fmt='%.6g');
+        for r1 in range(0, len(self), rows):
+            block = np.column_stack([self.time[r1:r1 + rows],
+                                     self.gd[r1:r1 + rows]]);
+            np.savetxt(f, block, fmt='%.6g');
+        f.close();
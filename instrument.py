@@ -0,0 +1,131 @@
+"""
+
+Python Module of Functions
+------ ------ -- ---------
+
+Dependencies: time, json, functools.
+-------------
+
+Description :
+-----------
+
+    Opt-in instrumentation of the analysis. When enabled, the modules of
+    the package record the wall time of their stages (loading, near_sweep,
+    spectrogram, good_bounds, fit, figures, ...) and counts of calls (quad,
+    brentq, forward model and jacobian evaluations, curve_fit nfev). Times
+    of nested stages are also in the outer one (take_bf has spectrogram).
+
+    Everything is kept in totals and, inside an Instant block, in a record
+    for that instant. When disabled (default) each probe just checks a
+    flag, so the cost is negligible.
+
+Example to Use:
+------- -- ----
+
+    >>> import instrument as ins
+    >>> ins.Enable()
+    >>> with ins.Instant(70.0): M.EvalGD(70.0, True)
+    >>> ins.Report()['instants'][0]['count']['quad']
+    >>> ins.Dump('run.json')
+
+    Records of other processes (as returned by Instant) are joined by Add.
+
+Developed by: Alex Andriati - USP
+
+"""
+
+import time, json, functools;
+
+ENABLED = False;
+_totals = {'time': {}, 'count': {}};
+_instants = [];
+_current = [];      # records of open Instant blocks.
+
+def Enable(on=True):
+    global ENABLED;
+    ENABLED = on;
+
+def Disable(): Enable(False);
+
+def Reset():
+    """ Forget everything recorded. """
+    _totals['time'].clear();
+    _totals['count'].clear();
+    del _instants[:];
+
+def _Add(kind, name, value):
+    _totals[kind][name] = _totals[kind].get(name, 0) + value;
+    for record in _current:
+        record[kind][name] = record[kind].get(name, 0) + value;
+
+def Count(name, n=1):
+    """ Add n to the counter name. """
+    if ENABLED: _Add('count', name, n);
+
+class Stage:
+    """ Block (with statement) whose wall time is added to stage name. """
+
+    def __init__(self, name): self.name = name;
+
+    def __enter__(self):
+        if ENABLED: self.start = time.time();
+        return self;
+
+    def __exit__(self, *exc):
+        if ENABLED and hasattr(self, 'start'):
+            _Add('time', self.name, time.time() - self.start);
+        return False;
+
+def Timed(name):
+    """ Decorator to record the wall time of a function as stage name. """
+    def decorator(func):
+        @functools.wraps(func)      # same name and module, can be pickled.
+        def wrapper(*args, **kwargs):
+            if not ENABLED: return func(*args, **kwargs);
+            with Stage(name): return func(*args, **kwargs);
+        return wrapper;
+    return decorator;
+
+class Instant:
+    """ Block (with statement) of the analysis of instant t (ms). Stages
+        and counts inside are also kept in its record (.record), that is
+        appended to the report at the end. """
+
+    def __init__(self, t):
+        self.record = {'t': t, 'time': {}, 'count': {}};
+
+    def __enter__(self):
+        self.open = ENABLED;
+        if self.open:
+            self.start = time.time();
+            _current.append(self.record);
+        return self;
+
+    def __exit__(self, *exc):
+        if self.open:
+            self.open = False;
+            _current.pop();
+            self.record['time']['instant'] = time.time() - self.start;
+            _totals['time']['instant'] = (_totals['time'].get('instant', 0)
+                                          + self.record['time']['instant']);
+            _instants.append(self.record);
+        return False;
+
+def Add(record):
+    """ Join the record of an instant taken in other process. """
+    for kind in ['time', 'count']:
+        for name, value in record[kind].items():
+            _totals[kind][name] = _totals[kind].get(name, 0) + value;
+    _instants.append(record);
+
+def Report():
+    """ Dictionary with totals and the record of each instant. """
+    return {'totals': {'time': dict(_totals['time']),
+                       'count': dict(_totals['count'])},
+            'instants': sorted(_instants, key=lambda r: r['t'])};
+
+def Dump(path):
+    """ Write Report in a json file. """
+    f = open(path, 'w');
+    json.dump(Report(), f, indent=2, sort_keys=True);
+    f.close();
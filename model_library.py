@@ -0,0 +1,143 @@
+"""
+
+Python Module of Functions
+------ ------ -- ---------
+
+Dependencies: os, numpy, gaussian_hat.
+-------------
+
+Description :
+-----------
+
+    Library of group delay curves of gaussian_hat over a grid of params
+    (n0, alpha, A, s), taken on points of the probe frequency axis of
+    SF_analysis (PF), to give fit_GD a first guess near the global minimum.
+
+    Curves are kept as float32 in a npz file (LibraryFile), made once for
+    each axis. A measured curve is compared just on the library points
+    that have a measured point near (the bands and the cut of CrossCenter
+    leave gaps), by brute force over all curves: with the points masked
+    a tree index doesnt help and 10^4 curves take some milliseconds.
+
+    As the group delay depends on n0 just by r = n(F) / n0, curves of all
+    n0 are taken in one call for each (alpha, A, s) scaling frequencies.
+
+Example to Use:
+------- -- ----
+
+    >>> import model_library as ml
+    >>> ml.LoadLibrary(M.PF * 1E9)       # build the first time (~1 min)
+    >>> p, dist = ml.BestGuess(pf, gd)   # Hz and seconds, like fit_GD
+    >>> # fit_GD use it by itself when a library is loaded.
+
+Developed by: Alex Andriati - USP
+
+"""
+
+import os, numpy as np;
+import gaussian_hat as gh;
+
+# Library settings
+# ------- --------
+
+LibN0     = (0.2E19, 5.0E19, 24);   # n0 (min, max, points) log scale.
+LibAlpha  = (0.5, 4.0, 10);         # alpha log scale.
+LibA      = (0.0, 1.2, 8);          # A linear.
+LibS      = (0.01, 0.12, 6);        # s (m) linear.
+LibPoints = 96;                     # points of the axis kept.
+LibraryFile = os.path.join(os.path.expanduser('~'), '.reflectometry',
+                           'gd_library.npz');
+_library = None;    # loaded library, None means usual guess.
+
+def Grid():
+    """ Arrays of n0, alpha, A and s of the library. """
+    n0 = np.logspace(np.log10(LibN0[0]), np.log10(LibN0[1]), LibN0[2]);
+    alpha = np.logspace(np.log10(LibAlpha[0]), np.log10(LibAlpha[1]),
+                        LibAlpha[2]);
+    A = np.linspace(*LibA);
+    s = np.linspace(*LibS);
+    return (n0, alpha, A, s);
+
+def LibraryAxis(PF, points=None):
+    """ Points of the frequency axis PF (Hz) kept in the library. """
+    if points is None: points = LibPoints;
+    PF = np.sort(np.asarray(PF, dtype=float));
+    return PF[np.linspace(0, PF.size - 1, points).astype(int)];
+
+def BuildLibrary(axis):
+    """ Return (params, curves), params (models, 4) and curves (models,
+        axis.size) in float32 of group delay (s) on axis (Hz). """
+    n0, alpha, A, s = Grid();
+    # Same r = n(F) / n0 with n0 = n0[0] and frequencies scaled.
+    F = (axis[None, :] * np.sqrt(n0[0] / n0)[:, None]).ravel();
+    params = []; curves = [];
+    for al in alpha:
+        for amp in A:
+            for width in s:
+                gd = gh.OptGroupDelay(F, n0[0], al, amp, width);
+                curves.append(gd.reshape(n0.size, axis.size));
+                params.append(np.array([[n, al, amp, width] for n in n0]));
+    return (np.concatenate(params), np.concatenate(curves).astype('f4'));
+
+def LoadLibrary(PF, path=None, rebuild=False):
+    """ Turn on the library for the frequency axis PF (Hz). Read it from
+        path (default LibraryFile) or build and save it there if it doesnt
+        exist, was made for other axis or grid, or rebuild is True.
+        Return the number of curves. """
+    global _library;
+    if path is None: path = LibraryFile;
+    axis = LibraryAxis(PF);
+    library = None;
+    if not rebuild and os.path.isfile(path):
+        data = np.load(path);
+        library = dict((k, data[k]) for k in data.files);
+        if not _SameLibrary(library, axis): library = None;
+    if library is None:
+        print '\nBuilding group delay library, can take a minute...'
+        params, curves = BuildLibrary(axis);
+        library = {'axis': axis, 'params': params, 'curves': curves,
+                   'grid': _GridKey()};
+        folder = os.path.dirname(path);
+        if folder != '' and not os.path.exists(folder): os.makedirs(folder);
+        np.savez(path, **library);
+    _library = library;
+    return library['params'].shape[0];
+
+def UnloadLibrary():
+    """ Turn off the library, fit_GD back to usual guess. """
+    global _library;
+    _library = None;
+
+def IsLoaded(): return _library is not None;
+
+def _GridKey():
+    return np.array(LibN0 + LibAlpha + LibA + LibS, dtype=float);
+
+def _SameLibrary(library, axis):
+    return (library['axis'].shape == axis.shape
+            and np.allclose(library['axis'], axis)
+            and np.allclose(library['grid'], _GridKey()));
+
+def BestGuess(pf, gd, tol=None):
+    """ Params (n0, alpha, A, s) of the library curve nearest (mean square)
+        to measured gd (s) at pf (Hz), and the rms distance. Just library
+        points with a measured point closer than tol (Hz, default half the
+        step of the library axis) are compared. None if no library or
+        less than 2 measured points. """
+    if _library is None: return (None, None);
+    axis = _library['axis'];
+    if tol is None: tol = 0.5 * np.diff(axis).max();
+    order = np.argsort(pf);
+    pf = np.asarray(pf, dtype=float)[order];
+    gd = np.asarray(gd, dtype=float)[order];
+    if pf.size < 2: return (None, None);
+    # Nearest measured point of each library point.
+    j = np.clip(np.searchsorted(pf, axis), 1, pf.size - 1);
+    j = np.where(np.abs(pf[j - 1] - axis) < np.abs(pf[j] - axis), j - 1, j);
+    j = np.clip(j, 0, pf.size - 1);
+    near = np.abs(pf[j] - axis) < tol;
+    if not near.any(): return (None, None);
+    diff = _library['curves'][:, near] - gd[j[near]].astype('f4');
+    dist = np.einsum('ij,ij->i', diff, diff);
+    best = dist.argmin();
+    return (_library['params'][best], np.sqrt(dist[best] / near.sum()));
@@ -3,7 +3,8 @@
 Python Module of Functions
 ------ ------ -- ---------
 
-Dependencies: gaussian_hat, matplotlib.pyplot, numpy, scipy.optimize.
+Dependencies: gaussian_hat, matplotlib.pyplot, numpy, scipy.optimize, render,
+              model_library.
 -------------
 
 Example to Use:
@@ -17,16 +18,10 @@ Developed by: Alex Andriati - USP
 
 """
 
-import scipy.optimize as opt, gaussian_hat as gh;
+import scipy.optimize as opt, gaussian_hat as gh, instrument as ins;
+import model_library as ml;
 import numpy as np, matplotlib.pyplot as plt
-
-# Define Figure Custom Options.
-from matplotlib import rcParams;
-rcParams['font.family'] = 'sans-serif';
-rcParams['font.sans-serif'] = ['Computer Modern Sans serif'];
-rcParams['ytick.labelsize'] = 'large';
-rcParams['xtick.labelsize'] = 'large';
-rcParams['text.usetex'] = True;
+import render;     # figure options (LaTeX or mathtext) and render queue.
 
 a = 0.18; Rwall = 0.22; c = 299792458.0;
 
@@ -37,16 +32,34 @@ def CrossCenter(GD):
         if (GD[i] > 2.2E-9): return i;
     return sentinel;
 
-def fit_GD(pf, gd, time=70.0, path='', show_it=False, saveIm=True):
+def CountCalls(func):
+    """ Wrap func to count how many times it is called (in .calls). """
+    def wrapper(*args):
+        wrapper.calls += 1;
+        return func(*args);
+    wrapper.calls = 0;
+    return wrapper;
+
+def fit_GD(pf, gd, time=70.0, path='', show_it=False, saveIm=True,
+           use_jac=True, p0=None):
     """ First two arguments takes the data. Others arguments optional.
         Based on data points call curve_fit for the profile defined
         by gaussian_hat, wich can be generalized for others profiles.
+        With use_jac the analytic jacobian of gaussian_hat is given to
+        curve_fit, otherwise it takes finite differences. p0 is a first
+        guess (as the params of a near instant in a time scan); if the
+        fit from it fails the next guess is tried: the nearest curve of
+        model_library (if loaded) and last the guess from CrossCenter.
 
         Return a python dictionary with keys:
 
         params -> Result params of the curve_fit
         mcov ---> Covariance Matrix
         res ----> Residuals for each point to the curve.
+        nfev ---> Number of model evaluations (finite differences too)
+        njev ---> Number of jacobian evaluations
+        warm ---> True if the fit started from p0
+        guess --> Guess that gave the result ('p0', 'library', 'usual')
     """
 
     # Find the most possible 'cross center (CC)' density point.
@@ -62,9 +75,45 @@ def fit_GD(pf, gd, time=70.0, path='', show_it=False, saveIm=True):
     # Take the best curve by least square method.
     # It depends strongly of initial guess in both quality and time.
     # Besides it, make some statistics of the result.
-    guess = [0.81 * n0_ref, 1.3, 0.5, 0.3 * a];
-    p, mcov = opt.curve_fit(gh.OptGroupDelay, pf[:CC], gd[:CC], p0=guess);
+    guesses = [] if p0 is None else [('p0', list(p0))];
+    with ins.Stage('library'):
+        best, dist = ml.BestGuess(pf[:CC], gd[:CC]);
+    if best is not None: guesses.append(('library', list(best)));
+    guesses.append(('usual', [0.81 * n0_ref, 1.3, 0.5, 0.3 * a]));
+    model = CountCalls(gh.OptGroupDelay);
+    jac   = CountCalls(gh.OptJacobian) if use_jac else None;
+    with ins.Stage('fit'):
+        for k, (name, guess) in enumerate(guesses):
+            last = (k == len(guesses) - 1);
+            try: p, mcov = opt.curve_fit(model, pf[:CC], gd[:CC], p0=guess,
+                                         jac=jac);
+            except RuntimeError:
+                if last: raise;
+                print 'Fit from %s guess failed, try next guess.' % name
+                continue;
+            # Covariance not estimated, the result is not trusted.
+            if last or np.isfinite(mcov).all(): break;
+    warm = (name == 'p0');
+    ins.Count('guess_' + name);
+    njev = jac.calls if use_jac else 0;
+    ins.Count('curve_fit_nfev', model.calls);
+    ins.Count('curve_fit_njev', njev);
+    print 'Function evaluations: %d, jacobian evaluations: %d' % \
+          (model.calls, njev);
     residuals = gh.Residues(pf[:CC], gd[:CC], p[0], p[1], p[2], p[3]);
+    if saveIm or show_it:
+        render.Draw(DrawFit, pf, gd, CC, p, residuals, time, path,
+                    show=show_it, saveIm=saveIm);
+
+    return {'params': p, 'mcov': mcov, 'res': residuals,
+            'nfev': model.calls, 'njev': njev, 'warm': warm, 'guess': name}
+
+@ins.Timed('fit_figure')
+def DrawFit(pf, gd, CC, p, residuals, time=70.0, path='', show=False,
+            saveIm=True):
+    """ Figure of the data (pf, gd), CC as from CrossCenter, and the curve
+        of fitted params p with the band of the residuals deviation. Called
+        through render.Draw (in background if a queue was started). """
     # Remake the curve data for more resolution and change units.
     # Calculate some immediately results and standart deviation.
     n_max = p[0] * (1 + p[2]**2);
@@ -87,7 +136,7 @@ def fit_GD(pf, gd, time=70.0, path='', show_it=False, saveIm=True):
     plt.ylim(0.4, 2.2);
     plt.xlabel(r'Probe Frequency (GHz)', fontsize=18);
     plt.ylabel(r'Group Delay (ns)', fontsize=18);
-    plt.title(r'\#31877', fontsize=18);
+    plt.title(r'\#31877' if render.UseTex() else '#31877', fontsize=18);
 
     # Plot data Points
     # ---- ---- ------
@@ -101,7 +150,9 @@ def fit_GD(pf, gd, time=70.0, path='', show_it=False, saveIm=True):
     # -------- --------- - -------- ------- --- ----
 
     line1 = '$n_{max} =\\ %.2f \\cdot 10^{19} [\\mathrm{m}^{-3}]$\n';
-    line2 = '$\\displaystyle \\left(\\frac{\\sigma}{a}\\right)\\ =\\ %.2f$\n';
+    line2 = '$\\left(\\frac{\\sigma}{a}\\right)\\ =\\ %.2f$\n';
+    # displaystyle is just for LaTeX, mathtext doesnt know it.
+    if render.UseTex(): line2 = line2.replace('$', '$\\displaystyle ', 1);
     line3 = '$\\qquad \\beta  \\ =\\ %.2f$\n';
     line4 = '$\\qquad \\alpha \\ =\\ %.2f$';
     line_name = line1 + line2 + line3 + line4;
@@ -119,7 +170,5 @@ def fit_GD(pf, gd, time=70.0, path='', show_it=False, saveIm=True):
         fig_name = path + 'time_%.2f.png' % time;
         fig.savefig(fig_name, dpi=150, bbox_inches='tight');
 
-    if(show_it): plt.show(fig);
-    else:        plt.close(fig);
-
-    return {'params': p, 'mcov': mcov, 'res': residuals}
+    if(show): plt.show(fig);
+    else:     plt.close(fig);
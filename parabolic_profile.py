@@ -12,9 +12,20 @@
     
     Numeric integration with trapezium method. More Datils see ProfileInt
     function.
+
+    Optionally a table engine can be turned on with LoadTable. After the
+    scaling x = a * xi the integral depends just on (alpha, r), so it is
+    tabulated once on a 2-D grid, saved on disk (TableFile) and then
+    OptGroupDelay is answered by vectorized spline interpolation. On the
+    default grid the relative error of the table is about 1E-5, well below
+    the 1E-3 tolerance of quad. The bound measured on the middle points of
+    the grid is kept in the table (key 'bound'). Points out of the grid
+    fall back to quad.
 """
 
-import numpy as np, scipy.integrate as integ
+import os, numpy as np, scipy.integrate as integ
+import instrument as ins
+from scipy.interpolate import RectBivariateSpline
 
 # Useful constants in IS system
 # ------ --------- -- -- ------
@@ -23,6 +34,16 @@ a = 0.18; Rwall = 0.22;
 epslon_o = 8.854187817E-12; e = 1.6021766E-19; 
 c = 299792458.0; me = 9.109389E-31;
 
+# Table engine settings
+# ----- ------ --------
+
+TableAlpha = (0.3, 8.0, 49);            # alpha (min, max, points) log scale.
+TableXc    = (-12.0, np.log(0.99), 97); # log(xc / a) when r < 1.
+TableR     = (-12.0, np.log(100), 81);  # log(r - 1) when r > 1.
+TableFile  = os.path.join(os.path.expanduser('~'), '.reflectometry',
+                          'parabolic_table.npz');
+_table     = None;  # loaded table, None means quad engine.
+
 # Functions
 # ---------
 
@@ -46,6 +67,7 @@ def Func(x, alpha, r):
 def ProfileInt (xc, alpha, r) :
     """ Make numeric integration based on Density profile with trapezes
         r: ratio of critic density to central density.              """
+    ins.Count('quad');
     if (xc > 0):
         return integ.quad(Func, xc, a, args=(alpha, r),
                 epsrel=1.0e-3)[0];
@@ -66,25 +88,132 @@ def ProfileInt (xc, alpha, r) :
                    Integrate over plasma diameter.
 """
 
+def GroupDelayPoint (r, alpha) :
+    """ Group Delay for a single density ratio r with quad. """
+    if (r < 1) :
+        xc = FrequencyToX(r, alpha);
+        return 2 * ProfileInt(xc, alpha, r) / c;
+    return 2 * ProfileInt(False, alpha, r) / c + 2 * (Rwall - a)/c;
+
 def OptGroupDelay (F, n0, alpha) :
-    """ Function to be optimized - alpha Optional parameter."""
+    """ Function to be optimized - alpha Optional parameter.
+    Use the table engine if LoadTable was called. """
     if (alpha <= 0) :
         groupDelay = np.zeros(F.size);
         groupDelay = groupDelay.reshape(F.shape);
         return groupDelay;
 	
     r = FrequencyToDensity(F) / n0;
+    if _table is not None: return TableGroupDelay(r, alpha);
     groupDelay = np.ones([r.size]) * 1E-9;
     groupDelay = groupDelay.reshape(r.shape);
     for i in range(r.size) : 
-        if (r[i] < 1) :
-            xc = FrequencyToX(r[i], alpha);
-            groupDelay[i] = 2 * ProfileInt(xc, alpha, r[i]) / c;
-        else :
-            groupDelay[i] = 2 * ProfileInt(False, alpha, r[i]) / c \
-            + 2 * (Rwall - a)/c;
+        groupDelay[i] = GroupDelayPoint(r[i], alpha);
     return groupDelay;
 
+# Table engine
+# ----- ------
+
+def ScaledCutoffInt (alpha, t) :
+    """ Integral over xi from xc = exp(t) to 1 written in a way that
+    avoid round off near the cutoff (used to build the table). """
+    xc = np.exp(t); d = 1.0 - xc**2;
+    f = lambda xi: 1.0 / np.sqrt(-np.expm1(alpha *
+                                 np.log1p(-(xi**2 - xc**2) / d)));
+    return integ.quad(f, xc, 1, epsrel=1.0e-10, limit=200)[0];
+
+def ScaledCrossInt (alpha, v) :
+    """ Integral over xi from -1 to 1 for r = 1 + exp(v). """
+    r = 1.0 + np.exp(v);
+    f = lambda xi: 1.0 / np.sqrt(1.0 - (1.0 - xi**2)**alpha / r);
+    return 2 * integ.quad(f, 0, 1, epsrel=1.0e-10, limit=200)[0];
+
+def BuildTable () :
+    """ Tabulate the scaled integrals over the grids TableAlpha,
+    TableXc and TableR. Takes some seconds, done just once. """
+    al = np.exp(np.linspace(np.log(TableAlpha[0]), np.log(TableAlpha[1]),
+                            TableAlpha[2]));
+    tc = np.linspace(*TableXc);
+    vr = np.linspace(*TableR);
+    low  = np.array([[ScaledCutoffInt(A, t) for t in tc] for A in al]);
+    high = np.array([[ScaledCrossInt(A, v) for v in vr] for A in al]);
+    table = {'alpha': al, 't': tc, 'v': vr, 'low': low, 'high': high};
+    # Measure the error in the middle of grid cells (every other cell).
+    _MakeSplines(table);
+    am = 0.5 * (al[1:] + al[:-1])[::2];
+    tm = 0.5 * (tc[1:] + tc[:-1])[::2];
+    vm = 0.5 * (vr[1:] + vr[:-1])[::2];
+    err_low  = max(abs(table['S_low'].ev(A, t) / ScaledCutoffInt(A, t) - 1)
+                   for A in am for t in tm);
+    err_high = max(abs(table['S_high'].ev(A, v) / ScaledCrossInt(A, v) - 1)
+                   for A in am for v in vm);
+    table['bound'] = max(err_low, err_high);
+    return table;
+
+def _MakeSplines (table) :
+    table['S_low']  = RectBivariateSpline(table['alpha'], table['t'],
+                                          table['low']);
+    table['S_high'] = RectBivariateSpline(table['alpha'], table['v'],
+                                          table['high']);
+
+def _SameGrid (table) :
+    return (table['alpha'].size == TableAlpha[2] and
+            table['t'].size == TableXc[2] and table['v'].size == TableR[2]
+            and np.allclose([table['alpha'][0], table['alpha'][-1]],
+                            TableAlpha[:2])
+            and np.allclose([table['t'][0], table['t'][-1]], TableXc[:2])
+            and np.allclose([table['v'][0], table['v'][-1]], TableR[:2]));
+
+def LoadTable (path=None, rebuild=False) :
+    """ Turn on the table engine. Read the table from path (default
+    TableFile) or build and save it there if it doesnt exist, was made
+    with another grid or rebuild is True. Return the error bound. """
+    global _table;
+    if path is None: path = TableFile;
+    table = None;
+    if not rebuild and os.path.isfile(path):
+        data = np.load(path);
+        table = dict((k, data[k]) for k in data.files);
+        table['bound'] = float(table['bound']);
+        if not _SameGrid(table): table = None;
+    if table is None:
+        print '\nBuilding group delay table, can take some seconds...'
+        table = BuildTable();
+        folder = os.path.dirname(path);
+        if folder != '' and not os.path.exists(folder): os.makedirs(folder);
+        np.savez(path, alpha=table['alpha'], t=table['t'], v=table['v'],
+                 low=table['low'], high=table['high'], bound=table['bound']);
+    _MakeSplines(table);
+    _table = table;
+    return table['bound'];
+
+def UnloadTable () :
+    """ Turn off the table engine, back to quad. """
+    global _table;
+    _table = None;
+
+def TableGroupDelay (r, alpha) :
+    """ Group Delay for an array of density ratios r by interpolation
+    on the loaded table. Points out of the grid use quad. """
+    r = np.asarray(r, dtype=float);
+    flat = r.ravel();
+    groupDelay = np.zeros(flat.size);
+    with np.errstate(all='ignore'):
+        t = 0.5 * np.log(-np.expm1(np.log(flat) / alpha));
+        v = np.log(flat - 1.0);
+        in_alpha = _table['alpha'][0] <= alpha <= _table['alpha'][-1];
+        low  = in_alpha & (flat > 0) & (flat < 1) & \
+               (t >= _table['t'][0]) & (t <= _table['t'][-1]);
+        high = in_alpha & (flat > 1) & \
+               (v >= _table['v'][0]) & (v <= _table['v'][-1]);
+    A = alpha * np.ones(flat.size);
+    groupDelay[low] = 2 * a * _table['S_low'].ev(A[low], t[low]) / c;
+    groupDelay[high] = 2 * a * _table['S_high'].ev(A[high], v[high]) / c \
+                       + 2 * (Rwall - a) / c;
+    for i in np.where(~(low | high))[0]:
+        groupDelay[i] = GroupDelayPoint(flat[i], alpha);
+    return groupDelay.reshape(r.shape);
+
 def Residues (xdata, ydata, n0, alpha) :
     """ return OptGroupDelay(xdata, n0, alpha) - ydata; """
     return ydata - OptGroupDelay(xdata, n0, alpha);
@@ -0,0 +1,156 @@
+"""
+
+Python Module of Functions
+------ ------ -- ---------
+
+Dependencies: os, multiprocessing, matplotlib.
+-------------
+
+Description :
+-----------
+
+    Figures of the analysis (spectrograms of TakeBF and fits of fit_GD)
+    are drawn by module functions called through Draw. By default they
+    are drawn at once, in the caller. After Start, figures to be saved are
+    sent to a queue of worker processes that render them with the Agg
+    backend while the analysis goes on; Stop waits for all of them. At
+    most 'pending' figures are waiting, so memory is bounded.
+
+    Figures shown on screen (show=True) are always drawn in the caller.
+    In a process that is not the one which started the queue (as workers
+    of time_evolution) figures are drawn at once, or kept after Defer to
+    be sent later by the parent with Submit.
+
+    Modes (MODE, set by Configure or REFLECTOMETRY_FIGURES):
+
+    'latex' ----> default, labels with LaTeX (text.usetex), one process
+                  per text.
+    'mathtext' -> labels with matplotlib mathtext (fast), chosen by
+                  time_evolution.py unless REFLECTOMETRY_FIGURES is set.
+    'none' -----> no figures at all, Draw returns at once.
+
+Example to Use:
+------- -- ----
+
+    >>> import render
+    >>> render.Start(workers=2)
+    >>> ... M.EvalGD(t, True, saveIm=True) ...     # figures in background
+    >>> render.Stop()                               # wait for them
+    >>> render.Configure('none')                    # no more figures
+
+Developed by: Alex Andriati - USP
+
+"""
+
+import os;
+from multiprocessing import Pool;
+from matplotlib import rcParams;
+
+MODES = ['latex', 'mathtext', 'none'];
+MODE = None;
+_queue = None;
+_deferred = None;
+
+def Configure(mode):
+    """ Choose mode of figures (see module help) and figure options. """
+    global MODE;
+    if mode not in MODES: raise ValueError('Unknow figure mode ' + str(mode));
+    MODE = mode;
+    rcParams['ytick.labelsize'] = 'large';
+    rcParams['xtick.labelsize'] = 'large';
+    if mode == 'latex':
+        rcParams['font.family'] = 'sans-serif';
+        rcParams['font.sans-serif'] = ['Computer Modern Sans serif'];
+        rcParams['text.usetex'] = True;
+    else:
+        rcParams['mathtext.fontset'] = 'cm';
+        rcParams['text.usetex'] = False;
+
+def UseTex(): return MODE == 'latex';
+
+def _InitWorker(mode):
+    import matplotlib.pyplot as plt;
+    plt.switch_backend('Agg');
+    Configure(mode);
+
+def _Run(func, args, kwargs):
+    func(*args, **kwargs);
+
+class RenderQueue:
+    """ Worker processes that run drawing functions. Functions and their
+        arguments must be pickable (module functions and arrays). """
+
+    def __init__(self, workers=1, pending=8):
+        self.pid = os.getpid();
+        self.pending = pending;
+        self.pool = Pool(workers, _InitWorker, (MODE,));
+        self.jobs = [];
+        self.done = 0;
+        self.failed = 0;
+
+    def Submit(self, func, *args, **kwargs):
+        """ Send a figure to be drawn, wait if too many are pending. """
+        self.jobs.append(self.pool.apply_async(_Run, (func, args, kwargs)));
+        while len(self.jobs) > self.pending: self.__Collect(self.jobs[0]);
+
+    def __Collect(self, job):
+        self.jobs.remove(job);
+        try:
+            job.get();
+            self.done += 1;
+        except Exception as err:
+            self.failed += 1;
+            print '\nFigure not rendered: %s' % err;
+
+    def Wait(self):
+        """ Wait all pending figures, return (done, failed). """
+        while self.jobs: self.__Collect(self.jobs[0]);
+        return (self.done, self.failed);
+
+    def Close(self):
+        result = self.Wait();
+        self.pool.close();
+        self.pool.join();
+        return result;
+
+def Start(workers=1, pending=None):
+    """ Start the background queue of this process. """
+    global _queue;
+    if _queue is not None: Stop();
+    _queue = RenderQueue(workers, pending or 4 * workers);
+
+def Stop():
+    """ Wait all figures and stop the queue. Return (done, failed). """
+    global _queue;
+    if _queue is None: return (0, 0);
+    result = _queue.Close();
+    _queue = None;
+    return result;
+
+def Defer():
+    """ Keep figures of this process to be returned by Deferred. """
+    global _deferred;
+    _deferred = [];
+
+def Deferred():
+    """ Figures kept since Defer, as (func, args, kwargs). """
+    global _deferred;
+    if _deferred is None: return [];
+    jobs = _deferred;
+    _deferred = [];
+    return jobs;
+
+def Submit(jobs):
+    """ Draw jobs taken by Deferred in other process. """
+    for func, args, kwargs in jobs: Draw(func, *args, **kwargs);
+
+def Draw(func, *args, **kwargs):
+    """ Draw figure func(*args, **kwargs) in the way set (module help). """
+    if MODE == 'none': return;
+    if kwargs.get('show'): return func(*args, **kwargs);
+    if _queue is not None and _queue.pid == os.getpid():
+        _queue.Submit(func, *args, **kwargs);
+    elif _deferred is not None: _deferred.append((func, args, kwargs));
+    else: func(*args, **kwargs);
+
+Configure(os.environ.get('REFLECTOMETRY_FIGURES', 'latex'));
@@ -0,0 +1,218 @@
+"""
+
+PYTHON CLASS & MODULE
+------ ----- - ------
+
+Dependencies : os, numpy.
+------------
+
+    Results of the fits of a time scan of one shot (time_evolution.py),
+    kept in a folder with one binary file for each column (raw little
+    endian, one row for each instant fitted):
+
+    t ---------> instant (ms)
+    params ----> params (n0, alpha, A, s) of fit_GD, NaN if failed
+    mcov ------> covariance matrix 4 x 4
+    n_max -----> center density n0 (1 + A^2) and its error sigma
+    sigma
+    res_rms ---> rms and largest absolute residual (s), and the number
+    res_max      of points fitted
+    points
+    status ----> FITTED or FAILED
+    guess -----> index in GUESSES of the guess of the result, -1 failed
+    nfev ------> model and jacobian evaluations of curve_fit
+    njev
+    seconds ---> wall time of the instant (group delay and fit)
+    info.dat --> shot number and version.
+
+    Rows are only appended, each one flushed to disk when the fit ends.
+    The number of rows is the one of the shortest column, so a row cut by
+    a crash is dropped (and truncated when opened to append again). A scan
+    started again skips the instants already in the store (Has), so an
+    interrupted scan just goes on. Columns are read by memory maps and a
+    time index sorted once, so a query of a time range reads just those
+    rows.
+
+HOW TO USE :
+------------
+
+    >>> import scan_store as ss
+    >>> S = ss.ScanStore('/results/#31877_results/scan/', 31877)
+    >>> S.Has(70.0)
+    >>> S.Append(70.0, result, seconds)     # result of fit_GD (or None)
+    >>> R = S.Range(60.0, 90.0)             # columns, in time order
+    >>> R['t'], R['n_max'], R['mcov']
+    >>> S.Column('params', 60.0, 90.0)
+    >>> S.Export('n_max.txt', 60.0, 90.0)   # text of time_evolution
+
+Developed by: Alex Andriati - USP.
+
+"""
+
+import os;
+import numpy as np;
+
+VERSION = 1;
+COLUMNS = [('t', '<f8', ()), ('params', '<f8', (4,)),
+           ('mcov', '<f8', (4, 4)), ('n_max', '<f8', ()),
+           ('sigma', '<f8', ()), ('res_rms', '<f8', ()),
+           ('res_max', '<f8', ()), ('points', '<i4', ()),
+           ('status', '<i1', ()), ('guess', '<i1', ()),
+           ('nfev', '<i4', ()), ('njev', '<i4', ()),
+           ('seconds', '<f8', ())];
+FAILED, FITTED = 0, 1;
+GUESSES = ['p0', 'library', 'usual'];
+Decimals = 6;       # instants are the same if equal to 1E-6 ms.
+
+def MaxDensity(params, mcov):
+    """ Center density n0 (1 + A^2) and its error from the covariance of
+        n0 and A. """
+    n0, A = params[0], params[2];
+    n_max = n0 * (1 + A**2);
+    der_n0 = (1 + A**2);
+    der_A  = n0 * (2 * A);
+    sigma  = np.sqrt((der_n0 * np.sqrt(mcov[0][0]))**2
+                     + (der_A * np.sqrt(mcov[2][2]))**2);
+    return (n_max, sigma);
+
+def _Key(t): return round(float(t), Decimals);
+
+class ScanStore:
+    """ Store of results of a scan in folder (see module help), made if
+        it doesnt exist. shot_number is checked with the one of the store.
+        mode 'a' to append, 'r' to read only. """
+
+    def __init__(self, folder, shot_number=None, mode='a'):
+        if folder[-1] != '/': folder = folder + '/';
+        self.folder = folder;
+        self.mode = mode;
+        if not os.path.isfile(folder + 'info.dat'):
+            if mode == 'r': raise IOError('No scan store in ' + folder);
+            if shot_number is None:
+                raise ValueError('shot_number is needed for a new store');
+            if not os.path.exists(folder): os.makedirs(folder);
+            for name, dtype, shape in COLUMNS:
+                open(self.__File(name), 'wb').close();
+            finfo = open(folder + 'info.dat', 'w');
+            finfo.write('shot:%d\nversion:%d\n' % (shot_number, VERSION));
+            finfo.close();
+        info = {};
+        finfo = open(folder + 'info.dat', 'r');
+        for line in finfo.read().splitlines():
+            key, value = line.split(':');
+            info[key] = int(value);
+        finfo.close();
+        if info.get('version') != VERSION:
+            raise IOError('Scan store of other version in ' + folder);
+        self.shot_number = info['shot'];
+        if shot_number is not None and shot_number != self.shot_number:
+            raise ValueError('Store of shot %d, not %d'
+                             % (self.shot_number, shot_number));
+        # Complete rows, a row cut by a crash is dropped.
+        sizes = [os.path.getsize(self.__File(name)) // self.__RowBytes(name)
+                 for name, dtype, shape in COLUMNS];
+        self.rows = min(sizes);
+        self.files = {};
+        if mode != 'r':
+            for name, dtype, shape in COLUMNS:
+                f = open(self.__File(name), 'r+b');
+                f.truncate(self.rows * self.__RowBytes(name));
+                f.close();
+                self.files[name] = open(self.__File(name), 'ab');
+        self.t = np.array(self.__Map('t'));
+        self.keys = set(_Key(t) for t in self.t);
+        self.order = None;
+
+    def __File(self, name): return self.folder + name + '.bin';
+
+    def __Spec(self, name):
+        for column in COLUMNS:
+            if column[0] == name: return column;
+        raise KeyError('No column ' + name);
+
+    def __RowBytes(self, name):
+        name, dtype, shape = self.__Spec(name);
+        return np.dtype(dtype).itemsize * int(np.prod(shape));
+
+    def __Map(self, name):
+        name, dtype, shape = self.__Spec(name);
+        if self.rows == 0: return np.zeros((0,) + shape, dtype=dtype);
+        return np.memmap(self.__File(name), dtype, 'r',
+                         shape=(self.rows,) + shape);
+
+    def __len__(self): return self.rows;
+
+    def Close(self):
+        for f in self.files.values(): f.close();
+        self.files = {};
+
+    def Has(self, t):
+        """ True if instant t (ms) is in the store. """
+        return _Key(t) in self.keys;
+
+    def Append(self, t, result, seconds=np.nan):
+        """ Write the row of instant t (ms) with result of fit_GD, or None
+            if it failed, and seconds taken. """
+        if not self.files: raise IOError('Scan store opened read only');
+        row = {'t': t, 'seconds': seconds};
+        if result is None:
+            row.update({'params': np.nan, 'mcov': np.nan, 'n_max': np.nan,
+                        'sigma': np.nan, 'res_rms': np.nan,
+                        'res_max': np.nan, 'points': 0, 'status': FAILED,
+                        'guess': -1, 'nfev': 0, 'njev': 0});
+        else:
+            res = np.asarray(result['res']);
+            n_max, sigma = MaxDensity(result['params'], result['mcov']);
+            row.update({'params': result['params'], 'mcov': result['mcov'],
+                        'n_max': n_max, 'sigma': sigma,
+                        'res_rms': np.sqrt(np.mean(res**2)),
+                        'res_max': np.abs(res).max(), 'points': res.size,
+                        'status': FITTED,
+                        'guess': GUESSES.index(result['guess']),
+                        'nfev': result['nfev'], 'njev': result['njev']});
+        # Time last, the row counts just when all columns are written.
+        for name, dtype, shape in COLUMNS[1:] + COLUMNS[:1]:
+            value = np.empty(shape, dtype=dtype);
+            value[...] = row[name];
+            f = self.files[name];
+            f.write(value.tostring());
+            f.flush();
+            os.fsync(f.fileno());
+        self.rows += 1;
+        self.t = np.append(self.t, t);
+        self.keys.add(_Key(t));
+        self.order = None;
+
+    def Rows(self, t1=None, t2=None):
+        """ Rows of instants from t1 to t2 (ms, both in), in time order. """
+        if self.order is None:
+            self.order = np.argsort(self.t, kind='mergesort');
+        ts = self.t[self.order];
+        i1 = 0 if t1 is None else np.searchsorted(ts, t1 - 10**-Decimals);
+        i2 = ts.size if t2 is None else np.searchsorted(ts,
+                                                        t2 + 10**-Decimals,
+                                                        'right');
+        return self.order[i1:i2];
+
+    def Column(self, name, t1=None, t2=None):
+        """ Column name of instants from t1 to t2 (ms), in time order. """
+        return np.array(self.__Map(name)[self.Rows(t1, t2)]);
+
+    def Range(self, t1=None, t2=None):
+        """ Dictionary of all columns from t1 to t2 (ms), in time order. """
+        rows = self.Rows(t1, t2);
+        return dict((name, np.array(self.__Map(name)[rows]))
+                    for name, dtype, shape in COLUMNS);
+
+    def Export(self, fileName, t1=None, t2=None):
+        """ Text file of fitted instants from t1 to t2 (ms) as written by
+            time_evolution: t, n_max, sigma, nfev, njev and warm. """
+        R = self.Range(t1, t2);
+        ok = R['status'] == FITTED;
+        warm = (R['guess'] == GUESSES.index('p0')).astype(int);
+        f = open(fileName, 'w');
+        for k in np.flatnonzero(ok):
+            f.write('%f\t%s\t%s\t%d\t%d\t%d\n'
+                    % (R['t'][k], R['n_max'][k], R['sigma'][k],
+                       R['nfev'][k], R['njev'][k], warm[k]));
+        f.close();
@@ -0,0 +1,155 @@
+"""
+
+PYTHON CLASS & MODULE
+------ ----- - ------
+
+Dependencies : os, shutil, hashlib.
+------------
+
+    Local cache of shots downloaded from the MDSplus server, used by
+    shot_data when it is constructed with a shot number. Each shot is kept
+    in the folder format of SaveShot (#<shot>/ with K.npy, KA.npy, ...)
+    plus a file with the version of the cache and the sha1 checksum of
+    each file, verified when the shot is read again. Shots of other
+    version (as those with the rate rounded by old SaveShot) are removed
+    and downloaded again. When the cache is bigger than max_bytes the
+    shots used less recently are removed.
+
+    Location and size can be given to the constructor or by environment
+    variables REFLECTOMETRY_CACHE (folder) and REFLECTOMETRY_CACHE_GB.
+    Default is ~/.reflectometry/shots with 20 GB.
+
+HOW TO USE :
+------------
+
+    >>> from shot_cache import ShotCache
+    >>> C = ShotCache('/data/cache', max_bytes=50 * 2**30)
+    >>> s = shot_data(31877, cache=C)   # download just the first time
+    >>> C.Entries(), C.Size()
+
+Developed by: Alex Andriati - USP.
+
+"""
+
+import os, shutil, hashlib, time;
+
+CHECKSUMS = 'checksums.dat';
+VERSION = 2;        # 2: rate saved with full precision.
+
+def FileChecksum(fileName, block=2**22):
+    """ sha1 of a file, read by blocks. """
+    h = hashlib.sha1();
+    f = open(fileName, 'rb');
+    data = f.read(block);
+    while data:
+        h.update(data);
+        data = f.read(block);
+    f.close();
+    return h.hexdigest();
+
+class ShotCache:
+    """ Folder with shots saved in SaveShot format, with checksums and
+        least recently used eviction when bigger than max_bytes. """
+
+    def __init__(self, path=None, max_bytes=None, verify=True):
+        if path is None:
+            path = os.environ.get('REFLECTOMETRY_CACHE', os.path.join(
+                   os.path.expanduser('~'), '.reflectometry', 'shots'));
+        if max_bytes is None:
+            max_bytes = float(os.environ.get('REFLECTOMETRY_CACHE_GB', 20));
+            max_bytes = int(max_bytes * 2**30);
+        self.path = path;
+        self.max_bytes = max_bytes;
+        self.verify = verify;
+        if not os.path.exists(path): os.makedirs(path);
+
+    def Folder(self, shot):
+        """ Folder of a shot in the cache. """
+        return os.path.join(self.path, '#' + str(shot)) + '/';
+
+    def Get(self, shot):
+        """ Return the folder of shot if it is in the cache and its files
+            match the checksums, else None. A corrupted entry is removed. """
+        folder = self.Folder(shot);
+        if not os.path.isfile(folder + CHECKSUMS): return None;
+        if self.Version(shot) != VERSION:
+            print '\nCache of shot %s is old, will download again.' % shot
+            self.Remove(shot);
+            return None;
+        if self.verify and not self.Verify(shot):
+            print '\nCache of shot %s corrupted, will download again.' % shot
+            self.Remove(shot);
+            return None;
+        os.utime(folder, None);     # mark as recently used.
+        return folder;
+
+    def Version(self, shot):
+        """ Version of the cache that stored shot (1 if not written). """
+        f = open(self.Folder(shot) + CHECKSUMS, 'r');
+        first = f.readline().split();
+        f.close();
+        if len(first) == 2 and first[0] == 'version': return int(first[1]);
+        return 1;
+
+    def Verify(self, shot):
+        """ True if all files of shot match their checksums. """
+        folder = self.Folder(shot);
+        f = open(folder + CHECKSUMS, 'r');
+        lines = f.read().splitlines();
+        f.close();
+        for line in lines:
+            name, checksum = line.split();
+            if name == 'version': continue;
+            if not os.path.isfile(folder + name): return False;
+            if FileChecksum(folder + name) != checksum: return False;
+        return True;
+
+    def Store(self, data):
+        """ Keep a shot_data in the cache and remove old shots if needed.
+            Files are written in a temporary folder first, so a shot
+            is never half stored. """
+        tmp = os.path.join(self.path, '.tmp_%d_%d' % (os.getpid(),
+                                                      int(1E6 * time.time())));
+        os.mkdir(tmp);
+        try:
+            data.SaveShot(tmp);
+            saved = os.path.join(tmp, '#' + str(data.shot_number)) + '/';
+            f = open(saved + CHECKSUMS, 'w');
+            f.write('version %d\n' % VERSION);
+            for name in sorted(os.listdir(saved)):
+                if name == CHECKSUMS: continue;
+                f.write('%s %s\n' % (name, FileChecksum(saved + name)));
+            f.close();
+            folder = self.Folder(data.shot_number);
+            if os.path.exists(folder): shutil.rmtree(folder);
+            os.rename(saved, folder);
+        finally: shutil.rmtree(tmp, ignore_errors=True);
+        self.Evict(keep=data.shot_number);
+        return folder;
+
+    def Remove(self, shot):
+        shutil.rmtree(self.Folder(shot), ignore_errors=True);
+
+    def Entries(self):
+        """ List of (last use, shot, bytes), the oldest first. """
+        entries = [];
+        for name in os.listdir(self.path):
+            folder = os.path.join(self.path, name);
+            if not name.startswith('#') or not os.path.isdir(folder): continue;
+            size = sum(os.path.getsize(os.path.join(folder, f))
+                       for f in os.listdir(folder));
+            entries.append((os.path.getmtime(folder), name[1:], size));
+        return sorted(entries);
+
+    def Size(self):
+        return sum(size for used, shot, size in self.Entries());
+
+    def Evict(self, keep=None):
+        """ Remove least recently used shots until size <= max_bytes. """
+        entries = self.Entries();
+        total = sum(size for used, shot, size in entries);
+        for used, shot, size in entries:
+            if total <= self.max_bytes: break;
+            if shot == str(keep): continue;
+            self.Remove(shot);
+            total -= size;
@@ -22,13 +22,149 @@ HOW TO USE :
     >>> # Where path_to_folder was used in s.SaveShot
     >>> all_accessible_data(s) = shot_data('path');
 
+    The start index of every sweep is found once per shot from the trigger
+    channel (s.sweep_start, s.sweep_count) and s.SweepAt(i) gives the sweep
+    start near sample i by binary search. SaveShot records it (sweeps.npy).
+
+    Saved shots can be opened in lazy mode, shot_data('path', lazy=True).
+    Channels are memory mapped (read only), so just the sweeps analysed are
+    read from disk and the page cache is shared by all processes that open
+    the same shot. The time s.T is then computed from indices on demand.
+
+    SaveShot can also write the chunked and compressed format of
+    shot_format.py, s.SaveShot('path', fmt='rfz'). Folders with shot.rfz
+    are read from it (if its header is good, else from the npy files),
+    decompressing just the sweeps accessed.
+
+    Shots taken from the server are kept in a local cache (shot_cache.py),
+    so next constructions with the same number read from disk. Pass
+    cache=False to always download or a ShotCache to choose where. On a
+    miss the channels are downloaded at the same time by 'connections'
+    MDSplus connections. Connections are made by the module function
+    Connect, that can be replaced by a local stand-in (as for tests).
+
+    To download just some parts of a shot give time windows in ms,
+    shot_data(31877, windows=[(2, 3), (60, 90)]). Just those samples are
+    asked to the server (subscripts in the TDI expression), with a margin
+    of one sweep period before and the ten sweeps averaged by TakeBF after
+    each window. Channels keep the indices of the whole record (see
+    WindowedChannel), so s.T, s.SweepAt and time to index conversions are
+    the same; samples out of the windows raise IndexError. Partial shots
+    are not kept in the cache nor saved.
+
+    Fixed frequency ('ff') and hopping frequency ('hf') shots are read and
+    saved in the same folder format (not rfz), with their frequency (freq)
+    or table of frequencies (freqs), restart time (rt) and time step (st)
+    in configuration.dat. They have no sweep index; Nsweep of 'hf' is the
+    samples of each step. See fixed_analyse.py to analyse them.
+
 Developed by: Alex Andriati - USP.
 
 """
 
 import os;
-import MDSplus as mds;
-from numpy import load, arange;
+import shot_format as sf;
+import shot_cache as sc;
+import instrument as ins;
+from multiprocessing.pool import ThreadPool;
+try: import MDSplus as mds;
+except ImportError: mds = None;     # Just saved shots or a stand-in Connect.
+from numpy import load, arange, where, concatenate, searchsorted, asarray;
+from numpy import zeros, nan;
+
+SERVER = 'tcabrcl.if.usp.br:8000';
+TREE = 'tcabr_ref';
+
+def Connect():
+    """ New connection with the server. """
+    if mds is None: raise IOError('MDSplus module not found.');
+    return mds.Connection(SERVER);
+
+@ins.Timed('download')
+def FetchNodes(shot, nodes, connections=4):
+    """ Return data of each node (or TDI expression) of shot. Each node
+        is taken by its own connection, 'connections' at same time. """
+    def fetch(node):
+        conn = Connect();
+        conn.openTree(TREE, shot);
+        try: return conn.get(node).data();
+        finally: conn.closeAllTrees();
+    if connections <= 1: return [fetch(node) for node in nodes];
+    pool = ThreadPool(min(connections, len(nodes)));
+    try: return pool.map(fetch, nodes);
+    finally: pool.close();
+
+def SweepEdges(trig, offset=0, first=True):
+    """ Indices (plus offset) where the trigger goes from non negative to
+        negative values. With first, index 0 counts if trig[0] < 0. """
+    edges = where((trig[1:] < 0) & (trig[:-1] >= 0))[0] + 1;
+    if first and trig.size > 0 and trig[0] < 0:
+        edges = concatenate([[0], edges]);
+    return edges + offset;
+
+class WindowedChannel:
+    """ Channel of a record with samples just in some windows, indexed
+        by the indices of the whole record (integer, slice or array of
+        integers). Each access must lie inside a single window, else
+        IndexError is raised. """
+
+    def __init__(self, size, starts, pieces):
+        self.size = size;
+        self.shape = (size,);
+        self.starts = asarray(starts, dtype=int);
+        self.pieces = pieces;
+        self.ends = self.starts + asarray([p.size for p in pieces], dtype=int);
+
+    def __len__(self): return self.size;
+
+    def __Piece(self, i1, i2):
+        """ Window that has samples i1 to i2 (not included). """
+        k = searchsorted(self.starts, i1, 'right') - 1;
+        if k < 0 or i2 > self.ends[k]:
+            raise IndexError('Samples %d to %d were not downloaded'
+                             % (i1, i2));
+        return k;
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.size);
+            if step < 0 or stop <= start: return asarray(self)[i];
+            k = self.__Piece(start, stop);
+            s0 = self.starts[k];
+            return self.pieces[k][start - s0:stop - s0:step];
+        idx = asarray(i);
+        idx = where(idx < 0, idx + self.size, idx);
+        if idx.size == 0: return zeros(idx.shape);
+        k = self.__Piece(int(idx.min()), int(idx.max()) + 1);
+        return self.pieces[k][idx - self.starts[k]];
+
+    def __array__(self, dtype=None):
+        """ Whole record, nan out of the windows. """
+        x = zeros(self.size) + nan;
+        for s0, piece in zip(self.starts, self.pieces):
+            x[s0:s0 + piece.size] = piece;
+        return x if dtype is None else x.astype(dtype);
+
+class TimeAxis:
+    """ Time vector in milliseconds computed on demand from indices,
+        T[i] = 1E3 * i / rate. Behave like the array of shot_data.T. """
+
+    def __init__(self, size, rate):
+        self.size = size;
+        self.rate = rate;
+
+    def __len__(self): return self.size;
+
+    def __getitem__(self, i):
+        if isinstance(i, slice): i = arange(*i.indices(self.size));
+        else:
+            i = asarray(i);
+            i = where(i < 0, i + self.size, i);
+        return 1E3 * i / self.rate;
+
+    def __array__(self, dtype=None):
+        T = 1E3 * arange(self.size) / self.rate;
+        return T if dtype is None else T.astype(dtype);
 
 class shot_data:
     """ A data Structure to read all accessible data from reflectometer.
@@ -46,22 +182,38 @@ class shot_data:
         >>> all_accessible_data(s) = shot_data('path');
     """
 
-    def __init__(self, shot):
+    @ins.Timed('load')
+    def __init__(self, shot, lazy=False, cache=True, connections=4,
+                 windows=None):
+        self.windows = None;     # sample ranges if taken in windows.
         if type(shot) == str and os.path.exists(shot): 
             # Construct data access from files on folder
             if shot[-1] != '/': 
-                self.__fromFiles(shot + '/');
+                self.__fromFiles(shot + '/', lazy);
                 self.shot_number = self.__tryGetNumber(shot + '/');
             else: 
-                self.__fromFiles(shot);
+                self.__fromFiles(shot, lazy);
                 self.shot_number = self.__tryGetNumber(shot);
 
         elif type(shot) == int:
-            # Construct data access from server
+            # Construct data access from local cache or server
             self.shot_number = shot;
-            self.__fromMDSplus();   
+            if cache is True: cache = sc.ShotCache();
+            folder = cache.Get(shot) if cache else None;
+            if folder is not None: self.__fromFiles(folder, lazy);
+            else: self.__fromMDSplus(connections, windows);
+            if cache and folder is None and windows is None:
+                self.__Keep(cache);
         else: raise IOError('Cant find any data for this constructor');
 
+    def __Keep(self, cache):
+        """ Store the shot in the cache. Modes SaveShot cant write and any
+            error of the cache just skip it, the shot is still returned. """
+        if self.mode not in ('sf', 'ff', 'hf'): return;
+        try: cache.Store(self);
+        except (IOError, OSError, TypeError) as err:
+            print '\nShot %d not kept in cache: %s' % (self.shot_number, err)
+
     def __tryGetNumber(self, path):
         for i in range(len(path) - 1):
             try: return int(path[i:-1]);
@@ -69,17 +221,21 @@ class shot_data:
         print '\nCant extract shot number. Will set as 11111.'
         return 11111;
 
-    def __fromFiles(self, pathTo):
+    def __fromFiles(self, pathTo, lazy=False):
+        # Chunked file just if its header is good, else the npy files.
+        if sf.FileMode(pathTo + sf.FILE_NAME) == 'sf':
+            self.__fromChunked(pathTo + sf.FILE_NAME);
+            return;
         files2read = ['K.npy', 'KA.npy', 'trigger.npy', 'configuration.dat']
         err_msg1 = 'The file %s doesnt exists or has inapropiate extension.'
-        err_msg2 = 'Sorry, system just read Sweep Frequency data yet.'
+        err_msg2 = 'Sorry, system just read sf, ff and hf modes.'
         for f in files2read:
             if not os.path.isfile(pathTo + f): raise IOError(err_msg1 % f);
         fconf = open(pathTo + 'configuration.dat', 'r');
         lines = fconf.read().splitlines();
         fconf.close();
-        if not self.__IsSweepMode(lines): raise IOError(err_msg2);
-        self.mode = 'sf';
+        self.mode = self.__ReadMode(lines);
+        if self.mode not in ('sf', 'ff', 'hf'): raise IOError(err_msg2);
         for line in lines:
             dot_Split = line.split(':');
             if   dot_Split[0] == 'rate': self.rate = float(dot_Split[1][:]);
@@ -89,39 +245,79 @@ class shot_data:
             elif dot_Split[0] == 'Ff': self.ff = float(dot_Split[1][:]);
             elif dot_Split[0] == 'sT': self.st = float(dot_Split[1][:]);
             elif dot_Split[0] == 'sI': self.si = float(dot_Split[1][:]);
-        self.K = load(pathTo + files2read[0]);
-        self.KA = load(pathTo + files2read[1]);
-        self.trig = load(pathTo + files2read[2]);
-        self.T = arange(0 , 1e3 * self.K.size / self.rate, 1e3 / self.rate);
+            elif dot_Split[0] == 'freq': self.freq = float(dot_Split[1][:]);
+            elif dot_Split[0] == 'rT': self.rt = float(dot_Split[1][:]);
+            elif dot_Split[0] == 'freqs':
+                self.freqs = asarray([float(x) for x in
+                                      dot_Split[1].split(',')]);
+        # In lazy mode channels are just mapped, read when accessed.
+        mmap = 'r' if lazy else None;
+        self.K = load(pathTo + files2read[0], mmap_mode=mmap);
+        self.KA = load(pathTo + files2read[1], mmap_mode=mmap);
+        self.trig = load(pathTo + files2read[2], mmap_mode=mmap);
+        if lazy: self.T = TimeAxis(self.K.size, self.rate);
+        else:
+            self.T = arange(0 , 1e3 * self.K.size / self.rate,
+                            1e3 / self.rate);
+        if self.mode == 'ff': return;
         self.Nsweep = int(1E-6 * self.st * self.rate);
+        if self.mode == 'hf': return;
+        if os.path.isfile(pathTo + 'sweeps.npy'):
+            self.sweep_start = load(pathTo + 'sweeps.npy');
+            self.sweep_count = self.sweep_start.size;
+        else: self.__IndexSweeps();
 
-    def __IsSweepMode(self, lines):
+    def __fromChunked(self, fileName):
+        """ Read header of chunked format, channels are read on demand. """
+        self.file = sf.ShotFile(fileName);
+        if self.file.mode != 'sf':
+            raise IOError('Sorry, system just read Sweep Frequency data yet.');
+        self.mode = self.file.mode;
+        for name, value in self.file.params.items(): setattr(self, name, value);
+        self.sample = int(self.sample);
+        self.K = self.file.Channel('K');
+        self.KA = self.file.Channel('KA');
+        self.trig = self.file.Channel('trigger');
+        self.T = TimeAxis(self.file.size, self.rate);
+        self.Nsweep = int(1E-6 * self.st * self.rate);
+        self.sweep_start = self.file.sweep_start;
+        self.sweep_count = self.sweep_start.size;
+
+    def Time(self, i):
+        """ Time in milliseconds of sample(s) i. """
+        return 1E3 * asarray(i) / self.rate;
+
+    def __ReadMode(self, lines):
         for line in lines:
             dot_Split = line.split(':');
-            if dot_Split[0] == 'mode' and dot_Split[1][1:] == 'sf':
-                return True;
-        return False;
+            if dot_Split[0] == 'mode': return dot_Split[1].strip();
+        return None;
 
-    def __fromMDSplus(self):
-        conn = mds.Connection('tcabrcl.if.usp.br:8000');
-        conn.openTree('tcabr_ref', self.shot_number);
+    def __fromMDSplus(self, connections=4, windows=None):
         print '\nDonwloading data from the server. Please wait.'
-        # Read in MDSplus format first to take time
-        # critical proccess, can take minutes depending
-        # on connection speed with server.
-        self.K  = conn.get('\\KBAND.SIGNAL');
-        self.KA = conn.get('\\KABAND.SIGNAL').data();
-        self.trig = conn.get('\\TRIGGER.SIGNAL').data();
-        # Organize in numpy arrays.
-        self.T = self.K.dim_of().data();
-        self.K = self.K.data();
+        self.__ParamsFromMDSplus();
+        if windows is not None:
+            self.__WindowsFromMDSplus(windows, connections);
+            return;
+        # Critical proccess, can take minutes depending
+        # on connection speed with server. Each channel
+        # by its own connection at same time.
+        nodes = ['\\KBAND.SIGNAL', '\\KABAND.SIGNAL', '\\TRIGGER.SIGNAL',
+                 'dim_of(\\KBAND.SIGNAL)'];
+        self.K, self.KA, self.trig, self.T = FetchNodes(self.shot_number,
+                                                        nodes, connections);
+        # Take correct vector of time (miliseconds)
+        self.T = 1E3 * self.T / self.rate;
+        if self.mode == 'sf': self.__IndexSweeps();
+
+    def __ParamsFromMDSplus(self):
+        conn = Connect();
+        conn.openTree(TREE, self.shot_number);
         # simple scalars or strings. Common parameters.
         self.rate = conn.get('\\REFPARAMETER.RATE').data();
         self.mode = str(conn.get('\\REFPARAMETER.REFMODE'));
         self.sample = conn.get('\\REFPARAMETER.SAMPLES').data();
         self.angle  = conn.get('\\REFPARAMETER.ANGLE').data();
-        # Take correct vector of time (miliseconds)
-        self.T = 1E3 * self.T / self.rate;
         # Identify mode and take others parameters.
         if self.mode == 'ff':
             print '\nFixed Frequency mode.'
@@ -131,7 +327,7 @@ class shot_data:
             self.freqs = conn.get('\\HOPPINGFREQ.FREQ_TABLE').data();   # GHz
             self.rt = conn.get('\\HOPPINGFREQ.RESTART_TIME').data();    # us
             self.st = conn.get('\\HOPPINGFREQ.TIME_STEP').data();       # us
-            self.Nsweep = int(1E-6 * self.rate * st);
+            self.Nsweep = int(1E-6 * self.rate * self.st);   # per step
         elif self.mode == 'sf':
             print '\nSweep Frequency mode.'
             self.fi = conn.get('\\SWEEPFREQ.FREQ_START').data();    # GHz
@@ -140,13 +336,76 @@ class shot_data:
             self.si = conn.get('\\SWEEPFREQ.INTERV_SWEEP').data();  # us
             self.Nsweep = int(1E-6 * self.st * self.rate);
         else: print '\nUnknow mode of operation.'
+        self.size = int(conn.get('size(\\KBAND.SIGNAL)').data());
         conn.closeAllTrees();
 
-    def SaveShot(self, path=''):
+    def __WindowRanges(self, windows):
+        """ Sorted and merged sample ranges [i1, i2) of time windows (ms),
+            with one sweep period before and 10 periods plus a sweep
+            after (sweeps averaged by TakeBF), inside the record. """
+        if self.mode == 'sf':
+            period = int(1E-6 * (self.st + self.si) * self.rate);
+            before = period;
+            after = 10 * period + self.Nsweep;
+        else: before = after = 0;
+        ranges = [];
+        for t1, t2 in sorted(windows):
+            i1 = max(0, int(self.rate * t1 * 1E-3) - before);
+            i2 = min(self.size, int(self.rate * t2 * 1E-3) + after);
+            if i2 <= i1: continue;
+            if ranges and i1 <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], i2);
+            else: ranges.append([i1, i2]);
+        if not ranges: raise ValueError('Windows out of the record.');
+        return ranges;
+
+    def __WindowsFromMDSplus(self, windows, connections=4):
+        """ Download just the samples of the time windows, by subscripts
+            of the signals done in the server. """
+        self.windows = self.__WindowRanges(windows);
+        names = ['\\KBAND.SIGNAL', '\\KABAND.SIGNAL', '\\TRIGGER.SIGNAL'];
+        # TDI ranges include the last index.
+        nodes = ['data(%s)[%d : %d]' % (name, i1, i2 - 1)
+                 for i1, i2 in self.windows for name in names];
+        data = FetchNodes(self.shot_number, nodes, connections);
+        starts = [i1 for i1, i2 in self.windows];
+        K, KA, trig = [data[k::3] for k in range(3)];
+        self.K = WindowedChannel(self.size, starts, K);
+        self.KA = WindowedChannel(self.size, starts, KA);
+        self.trig = WindowedChannel(self.size, starts, trig);
+        self.T = TimeAxis(self.size, self.rate);
+        # Sweeps are looked for inside each window.
+        edges = [SweepEdges(x, i1, i1 == 0) for x, i1 in zip(trig, starts)];
+        self.sweep_start = concatenate(edges);
+        self.sweep_count = self.sweep_start.size;
+
+    def __IndexSweeps(self):
+        """ Find every sweep start at once. A sweep start where the
+            trigger goes from non negative to negative values. """
+        self.sweep_start = SweepEdges(self.trig);
+        self.sweep_count = self.sweep_start.size;
+
+    def SweepAt(self, i):
+        """ Index of the sweep start near sample i. If the trigger is
+            negative at i return start of that sweep, else the start of
+            the next one. Raise IndexError after the last sweep. """
+        j = searchsorted(self.sweep_start, i, 'right');
+        if self.trig[i] < 0: return self.sweep_start[j - 1];
+        if j >= self.sweep_count: raise IndexError('No sweep after %d' % i);
+        return self.sweep_start[j];
+
+    def SaveShot(self, path='', fmt='npy'):
         """ Record data of a given shot. Make a file for each channel
             in format .npy, that can easily and rapidly read after. 
-            If any path is given save in current directory. """
-        if self.mode != 'sf': raise TypeError('Cant save this mode yet');
+            If any path is given save in current directory. With
+            fmt='rfz' write a single chunked and compressed file
+            (see shot_format.py), just for sweep mode. """
+        if self.mode not in ('sf', 'ff', 'hf'):
+            raise TypeError('Cant save this mode yet');
+        if fmt == 'rfz' and self.mode != 'sf':
+            raise TypeError('Just sweep mode can be saved in rfz');
+        if self.windows is not None:
+            raise IOError('Cant save a shot downloaded in windows');
         # Modules needed to record data.
         import os; from numpy import save;
         if path != '' and not os.path.exists(path): 
@@ -158,18 +417,31 @@ class shot_data:
         if not os.path.exists(path): os.mkdir(path);
         # Start save values
         print '\nSaving data at ' + path;
+        if fmt == 'rfz':
+            sf.WriteShot(path + sf.FILE_NAME, self);
+            return;
+        elif fmt != 'npy': raise ValueError('Unknow format ' + str(fmt));
         save(path + 'K.npy', self.K);
         save(path + 'KA.npy', self.KA);
         save(path + 'trigger.npy', self.trig);
+        if self.mode == 'sf': save(path + 'sweeps.npy', self.sweep_start);
         f = open(path + 'configuration.dat', 'w');
         # write common fixed parameters.
-        f.write('rate: %.2g' % self.rate);
+        f.write('rate: %r' % float(self.rate));     # exact, it gives T.
         f.write('\nsample: %d' % self.sample);
         f.write('\nangle: %.1f' % self.angle);
         f.write('\nmode: ' + self.mode);
-        # Data from sweep frequency mode.
-        f.write('\nFo: %.4f' % self.fi);    # GHz
-        f.write('\nFf: %4f' % self.ff);     # GHz
-        f.write('\nsT: %.4f' % self.st);    # us
-        f.write('\nsI: %.4f' % self.si);    # us
+        if self.mode == 'sf':
+            # Data from sweep frequency mode.
+            f.write('\nFo: %.4f' % self.fi);    # GHz
+            f.write('\nFf: %4f' % self.ff);     # GHz
+            f.write('\nsT: %.4f' % self.st);    # us
+            f.write('\nsI: %.4f' % self.si);    # us
+        elif self.mode == 'ff':
+            f.write('\nfreq: %.4f' % self.freq);    # GHz
+        else:
+            # Hopping table (GHz), restart time and time step (us).
+            f.write('\nfreqs: ' + ','.join('%.4f' % x for x in self.freqs));
+            f.write('\nrT: %.4f' % self.rt);
+            f.write('\nsT: %.4f' % self.st);
         f.close();
@@ -0,0 +1,288 @@
+"""
+
+Python Module of Functions
+------ ------ -- ---------
+
+Dependencies: numpy, struct, zlib.
+-------------
+
+Description :
+-----------
+
+    Chunked and compressed file format for reflectometer shots (shot.rfz),
+    alternative to the .npy files + configuration.dat of SaveShot.
+
+    Each channel is kept as 16 bits integers with a scale factor and an
+    offset (x = offset + scale * q) when the samples are raw digitizer
+    values (at most 2^16 levels on a regular grid) and decoding gives them
+    back bit by bit. Otherwise the channel is kept as raw floats (float32
+    or float64, as given), so the format never loses data. Samples are cut in
+    chunks of some sweeps (sweeps_per_chunk) and each chunk of each channel
+    is compressed alone with zlib, so any range of samples or sweeps can be
+    read without decompress the rest.
+
+    Binary header (little endian):
+
+        magic 'RFLXSHOT', version, mode, shot number, samples per channel;
+        named acquisition parameters (rate, sample, angle, fi, ff, st, si);
+        channels (name, scale, offset, kind 'i2', 'f4' or 'f8');
+        sweep index (start of each sweep);
+        chunk table (first sample, samples) and for each chunk and channel
+        (offset in file, compressed bytes).
+
+Example to Use:
+------- -- ----
+
+    >>> import shot_format as sf
+    >>> sf.WriteShot('#31877/shot.rfz', s)     # s is a shot_data, checked
+    >>> F = sf.ShotFile('#31877/shot.rfz')
+    >>> F.params['rate'], F.sweep_start
+    >>> K = F.Channel('K'); K[1000:5000]      # decompress just that
+    >>> F.Sweeps('KA', 10, 20)                # samples of sweeps 10 to 19
+
+    To convert old folders (K.npy, KA.npy, ...) in a shell:
+
+    $ python shot_format.py '#31877/' '#31878/' ...
+
+Developed by: Alex Andriati - USP
+
+"""
+
+import os, sys, struct, zlib;
+import numpy as np;
+from collections import OrderedDict;
+
+MAGIC = 'RFLXSHOT';
+VERSION = 2;      # 2 added the kind of each channel.
+FILE_NAME = 'shot.rfz';
+PARAMS = ['rate', 'sample', 'angle', 'fi', 'ff', 'st', 'si'];
+CHANNELS = [('K', 'K'), ('KA', 'KA'), ('trigger', 'trig')];
+
+def Quantize(x, sample=2**20):
+    """ Return (q, scale, offset) with q int16 and x = offset + scale * q
+        exactly (as float64), when x lies on a regular grid of at most 2^16
+        levels (the grid step is taken from the first 'sample' points).
+        Otherwise q is x as raw floats ('<f4' or '<f8'), scale 1 and offset
+        0. """
+    x = np.asarray(x);
+    raw = x.astype('<f4' if x.dtype == np.float32 else '<f8');
+    x = x.astype(float);
+    if x.size == 0: return (np.zeros(0, dtype='<i2'), 1.0, 0.0);
+    x_min = x.min(); x_max = x.max();
+    levels = np.unique(x[:sample]);
+    step = np.diff(levels).min() if levels.size > 1 else 1.0;
+    if (x_max - x_min) / step < 2**16 - 1:
+        q = np.round((x - x_min) / step);
+        if np.abs(x_min + q * step - x).max() <= 0.01 * step:
+            offset = x_min + 2**15 * step;
+            q = (q - 2**15).astype('<i2');
+            # Kept as integers just if decoding is bit exact.
+            if np.array_equal(offset + step * q, x): return (q, step, offset);
+    print '\nChannel is not on an exact 16 bits grid, kept as raw floats.'
+    return (raw, 1.0, 0.0);
+
+def Decode(data, kind, scale, offset):
+    """ Samples (float) of a decompressed chunk of a channel of kind 'i2',
+        'f4' or 'f8'. """
+    q = np.fromstring(data, dtype='<' + kind);
+    if kind == 'i2': return offset + scale * q;
+    return q.astype(float);
+
+def ChunkBounds(sweep_start, size, sweeps_per_chunk):
+    """ First sample of each chunk and the end (size). A chunk start
+        each sweeps_per_chunk sweeps. """
+    starts = [int(i) for i in sweep_start[::sweeps_per_chunk] if i > 0];
+    bounds = [0] + starts;
+    return np.array(bounds + [size], dtype=np.int64);
+
+def WriteShot(path, shot, sweeps_per_chunk=10, level=6, verify=True):
+    """ Write shot (a shot_data in sweep mode) in the chunked format.
+        With verify the file is read again and each chunk compared with
+        the samples given, IOError if any is not bit exact. """
+    channels = [(name, getattr(shot, attr)) for name, attr in CHANNELS];
+    size = channels[0][1].size;
+    quantized = [Quantize(x) for name, x in channels];
+    bounds = ChunkBounds(shot.sweep_start, size, sweeps_per_chunk);
+    nchunks = bounds.size - 1;
+    f = open(path, 'wb');
+    f.write(struct.pack('<8sI8sqq', MAGIC, VERSION, shot.mode,
+                        shot.shot_number, size));
+    f.write(struct.pack('<I', len(PARAMS)));
+    for name in PARAMS:
+        f.write(struct.pack('<16sd', name, float(getattr(shot, name))));
+    f.write(struct.pack('<I', len(channels)));
+    for (name, x), (q, scale, offset) in zip(channels, quantized):
+        f.write(struct.pack('<16sdd2s', name, scale, offset,
+                            q.dtype.str[1:]));
+    f.write(struct.pack('<q', shot.sweep_start.size));
+    f.write(np.asarray(shot.sweep_start, dtype='<i8').tostring());
+    f.write(struct.pack('<q', nchunks));
+    chunks = np.array([bounds[:-1], np.diff(bounds)], dtype='<i8').T;
+    f.write(chunks.tostring());
+    # Table of (offset, bytes) written after compressing the chunks.
+    table_pos = f.tell();
+    table = np.zeros([nchunks, len(channels), 2], dtype='<i8');
+    f.write(table.tostring());
+    for c in range(nchunks):
+        for k, (q, scale, offset) in enumerate(quantized):
+            data = q[bounds[c]:bounds[c + 1]].tostring();
+            data = zlib.compress(data, level);
+            table[c, k] = (f.tell(), len(data));
+            f.write(data);
+    f.seek(table_pos);
+    f.write(table.tostring());
+    f.close();
+    if verify: VerifyShot(path, channels);
+
+def VerifyShot(path, channels):
+    """ Compare each chunk of the file with the samples of channels, a
+        list of (name, samples). IOError if any is not bit exact. """
+    F = ShotFile(path, cached_chunks=1);
+    for name, x in channels:
+        for c, (i1, n) in enumerate(zip(F.chunk_start, F.chunk_size)):
+            if not np.array_equal(F.Chunk(name, c),
+                                  np.asarray(x[i1:i1 + n], dtype=float)):
+                raise IOError('Channel %s of %s is not exact in chunk %d'
+                              % (name, path, c));
+
+def FileMode(path):
+    """ Mode ('sf') of a shot file, None if its header cant be read. """
+    try:
+        f = open(path, 'rb');
+        try: head = f.read(36);
+        finally: f.close();
+        magic, version, mode, number, size = struct.unpack('<8sI8sqq', head);
+    except (IOError, struct.error): return None;
+    if magic != MAGIC or version > VERSION: return None;
+    return mode.rstrip('\0');
+
+class ShotFile:
+    """ Read access to a shot in the chunked format. Just the header is
+        read on construction, samples are decompressed when asked. """
+
+    def __init__(self, path, cached_chunks=8):
+        self.path = path;
+        f = open(path, 'rb');
+        magic, version, mode, number, size = struct.unpack('<8sI8sqq',
+                                                           f.read(36));
+        if magic != MAGIC: raise IOError('%s isnt a shot file' % path);
+        if version > VERSION: raise IOError('Unknow version %d' % version);
+        self.mode = mode.rstrip('\0');
+        self.shot_number = number;
+        self.size = size;
+        self.params = {};
+        for i in range(struct.unpack('<I', f.read(4))[0]):
+            name, value = struct.unpack('<16sd', f.read(24));
+            self.params[name.rstrip('\0')] = value;
+        self.channels = OrderedDict();
+        for k in range(struct.unpack('<I', f.read(4))[0]):
+            if version < 2:
+                name, scale, offset = struct.unpack('<16sdd', f.read(32));
+                kind = 'i2';
+            else:
+                name, scale, offset, kind = struct.unpack('<16sdd2s',
+                                                          f.read(34));
+            self.channels[name.rstrip('\0')] = (k, scale, offset, kind);
+        nsweeps = struct.unpack('<q', f.read(8))[0];
+        self.sweep_start = np.fromstring(f.read(8 * nsweeps), dtype='<i8');
+        nchunks = struct.unpack('<q', f.read(8))[0];
+        chunks = np.fromstring(f.read(16 * nchunks), dtype='<i8');
+        self.chunk_start = chunks.reshape(nchunks, 2)[:, 0];
+        self.chunk_size  = chunks.reshape(nchunks, 2)[:, 1];
+        table = np.fromstring(f.read(16 * nchunks * len(self.channels)),
+                              dtype='<i8');
+        self.table = table.reshape(nchunks, len(self.channels), 2);
+        f.close();
+        self.cached_chunks = cached_chunks;
+        self._chunks = OrderedDict();   # last decompressed chunks.
+
+    def Chunk(self, name, c):
+        """ Decompressed samples (float) of chunk c of channel name. """
+        key = (name, c);
+        if key in self._chunks:
+            x = self._chunks.pop(key);
+            self._chunks[key] = x;
+            return x;
+        k, scale, offset, kind = self.channels[name];
+        pos, nbytes = self.table[c, k];
+        f = open(self.path, 'rb');
+        f.seek(pos);
+        x = Decode(zlib.decompress(f.read(nbytes)), kind, scale, offset);
+        f.close();
+        self._chunks[key] = x;
+        if len(self._chunks) > self.cached_chunks:
+            self._chunks.popitem(last=False);
+        return x;
+
+    def Read(self, name, i1, i2):
+        """ Samples i1 to i2 (not included) of channel name. """
+        i1 = max(0, i1); i2 = min(self.size, i2);
+        if i2 <= i1: return np.zeros(0);
+        c1 = np.searchsorted(self.chunk_start, i1, 'right') - 1;
+        c2 = np.searchsorted(self.chunk_start, i2 - 1, 'right') - 1;
+        parts = [self.Chunk(name, c) for c in range(c1, c2 + 1)];
+        x = parts[0] if len(parts) == 1 else np.concatenate(parts);
+        first = self.chunk_start[c1];
+        return x[i1 - first:i2 - first];
+
+    def Sweeps(self, name, k1, k2):
+        """ Samples of channel name from start of sweep k1 until start of
+            sweep k2 (or the end of record). """
+        i1 = self.sweep_start[k1];
+        i2 = self.sweep_start[k2] if k2 < self.sweep_start.size else self.size;
+        return self.Read(name, i1, i2);
+
+    def Channel(self, name):
+        """ Array like access to a channel, see ChunkedChannel. """
+        return ChunkedChannel(self, name);
+
+class ChunkedChannel:
+    """ Channel of a ShotFile that can be indexed like an array (integer,
+        slice or array of integers). Just the chunks needed are read. """
+
+    def __init__(self, shot_file, name):
+        self.file = shot_file;
+        self.name = name;
+        self.size = shot_file.size;
+        self.shape = (shot_file.size,);
+
+    def __len__(self): return self.size;
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.size);
+            if step < 0 or stop <= start: return np.asarray(self)[i];
+            return self.file.Read(self.name, start, stop)[::step];
+        idx = np.asarray(i);
+        idx = np.where(idx < 0, idx + self.size, idx);
+        if idx.size == 0: return np.zeros(idx.shape);
+        i1 = int(idx.min()); i2 = int(idx.max()) + 1;
+        if i1 < 0 or i2 > self.size: raise IndexError('index out of range');
+        return self.file.Read(self.name, i1, i2)[idx - i1];
+
+    def __array__(self, dtype=None):
+        x = self.file.Read(self.name, 0, self.size);
+        return x if dtype is None else x.astype(dtype);
+
+def ConvertFolder(folder, sweeps_per_chunk=10):
+    """ Write shot.rfz in a folder saved in the old format (K.npy, KA.npy,
+        trigger.npy and configuration.dat). Old files are kept. Folders
+        not in sweep mode (ff, hf) are skipped with a message. """
+    import shot_data as sd;
+    if folder[-1] != '/': folder = folder + '/';
+    if os.path.isfile(folder + FILE_NAME):
+        print '\n%s alredy has %s.' % (folder, FILE_NAME);
+        return;
+    shot = sd.shot_data(folder, lazy=True);
+    if shot.mode != 'sf':
+        print '\n%s is in mode %s, just sweep mode is written in %s.' \
+              % (folder, shot.mode, FILE_NAME);
+        return;
+    WriteShot(folder + FILE_NAME, shot, sweeps_per_chunk);
+    old = sum(os.path.getsize(folder + f) for f in
+              ['K.npy', 'KA.npy', 'trigger.npy']);
+    new = os.path.getsize(folder + FILE_NAME);
+    print '\n%s: %.1f MB -> %.1f MB' % (folder, old / 2.**20, new / 2.**20);
+
+if __name__ == '__main__':
+    for folder in sys.argv[1:]: ConvertFolder(folder);
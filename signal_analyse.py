@@ -3,7 +3,8 @@
 PYTHON CLASS & MODULE
 ------ ----- - ------
 
-Dependencies : os, numpy, matplotlib, shot_data, optimization_GD
+Dependencies : os, numpy, matplotlib, shot_data, optimization_GD, spectrogram,
+               gd_map
 ------------
 
 Description :
@@ -30,6 +31,44 @@ How to use :
     If you dont give any path on computer will save on current folder.
     >>> M.SaveShot(path(optionally))
 
+    Spectrograms are computed for all sweeps at once by spectrogram.py. To
+    use the old mlab.specgram loop pass engine='mlab' to the constructor.
+    >>> M = sa.SF_analysis(shot_number, engine='mlab')
+    With engine='zoom' just the band of beat frequency (band, in Hz) is
+    taken, on the same frequencies (see spectrogram.ZoomSpecgram).
+    The power of each sweep is kept in a cache of cache_mb megabytes, so
+    near instants reuse it (M.spec.cache.hits, M.spec.cache.misses).
+
+    To download from the server just some time windows (ms) of the shot
+    pass them to the constructor. The window of the vacuum reference Tvac
+    is always added. Times out of the windows raise IndexError.
+    >>> M = sa.SF_analysis(shot_number, windows=[(60, 90)])
+
+    Any object like shot_data can be given instead of a shot (as the
+    StreamData of streaming.py, for shots still arriving). With Tvac=None
+    the vacuum reference is not taken, set M.vacBF = M.TakeBF(t) later.
+
+    The vacuum reference (vacBF, with PF, IKA and the spectrogram settings)
+    is saved in a file and read back next time if the settings match, so
+    a new object doesnt take it again. By default (reference='auto') the
+    file is vacuum.npz in the results folder; with no path it is just kept
+    in memory, nothing is written in the folder of the shot data. Shots
+    with the same sweep (fi, ff, st, rate) can share one reference of
+    ReferenceFolder, or of a file given. None turns it off (always taken,
+    never saved).
+    >>> M = sa.SF_analysis(shot_number, reference='shared')
+    >>> M = sa.SF_analysis(shot_number, reference='/data/vac_31877.npz')
+
+    The group delay of all instants of a shot is taken at once by
+    GroupDelayMap, written in memory mapped files (see gd_map.py) that
+    can be read later to fit, plot or export without spectra again.
+    >>> G = M.GroupDelayMap(50, 100)
+    >>> pf, gd = G.At(70.0)
+    >>> G = gm.GroupDelayMap(M.path + 'gd_map/')  # other session
+
+    Figures are drawn by render.py: after render.Start() they are saved by
+    background processes, render.Configure('none') turn them off.
+
     OBS: Some cuts of data are done before extract group delay because of
          instability of boundary and loss of amplitude signal.
 
@@ -43,7 +82,15 @@ import numpy as np;
 import matplotlib.mlab as mlab
 import matplotlib.pyplot as plt
 import optimization_gd as opt
+import spectrogram as sp
+import gd_map as gm
+import instrument as ins
+import render
 
+# Folder of references shared by shots with the same sweep.
+ReferenceFolder = os.path.join(os.path.expanduser('~'), '.reflectometry',
+                               'vacuum');
+ReferenceFile = 'vacuum.npz';   # name in results or shot folder.
 
 def time2index(rate, t):
     """ For t in milliseconds
@@ -57,6 +104,44 @@ def PreviousPow2(num):
     while(2**i < num): i += 1;
     return (i - 1);
 
+def DrawSpectra(S_K, S_Ka, pf, IKA, bf_inf, bf_sup, bf, figName=None,
+                show=False):
+    """ Figure of mean spectrograms of K and Ka bands (Ka from index IKA
+        of pf) with the beat frequency line. Saved in figName if given.
+        Called through render.Draw (in background if a queue was started).
+    """
+    # Scale to simple units.
+    BF_sup  = bf_sup / 1E6;
+    BF_inf  = bf_inf / 1E6;
+    BF      = bf / 1E6;
+    # image displayed one side for each band.
+    f, (ax1, ax2) = plt.subplots(1, 2, sharey=True, figsize=(18, 8));
+    # Draw Spectrum of K band.
+    ax1.imshow(np.log(S_K), origin='lower', aspect='auto', \
+            extent=[pf[0], pf[IKA-1], BF_inf, BF_sup]);
+    # Draw Spectrum of Ka band.
+    ax2.imshow(np.log(S_Ka), origin='lower', aspect='auto', \
+            extent=[pf[IKA], pf[-1], BF_inf, BF_sup]);
+    # Draw line of maximum for each spectrum.
+    ax1.plot(pf[:IKA], BF[:IKA], 'k-', linewidth=2);
+    ax2.plot(pf[IKA:], BF[IKA:], 'k-', linewidth=2);
+    # Figure limits.
+    f.subplots_adjust(wspace=0.02);
+    ax1.set_xlim(pf[0], pf[IKA-1]);
+    ax1.set_ylim(BF_inf, BF_sup);
+    ax2.set_xlim(pf[IKA], pf[-1]);
+    ax2.set_ylim(BF_inf, BF_sup);
+    # Figure labels (x comom label)
+    ax1.set_ylabel('Beat Frequency (MHz)', fontsize=16);
+    f.text(0.5, 0.03, 'Probe Frequency (GHz)', ha='center', fontsize=16);
+    ax1.set_title('\"K\" band', fontsize=16); 
+    ax2.set_title('\"Ka\" Band', fontsize=16);
+    if figName is not None: 
+        f.savefig(figName, dpi=150, bbox_inches='tight');
+    # if required display image.
+    if (show): plt.show(f);
+    else:      plt.close(f);
+
 class SF_analysis:
     """ Data Structure to analysis a sweep frequency signal.
         There are here main methods of interesr to analyse
@@ -65,25 +150,61 @@ class SF_analysis:
     c = 299792458.0;    # Light speed
     a = 0.18;           # Plasma Radius
     R_wall = 0.22;      # From center of plasma to camara wall.
+    band = (3.0E6, 17.0E6); # Beat frequencies taken by 'zoom' engine (Hz).
 
-    def __init__(self, shot, path = '', Tvac = 2):
+    def __init__(self, shot, path = '', Tvac = 2, engine = 'batch',
+                 cache_mb = 256, lazy = False, windows = None,
+                 reference = 'auto', peak = 'argmax'):
         """ Constructor. Optionally you can define the path
             to record resulds (second argument) or Time of
             vacuum signal reference (third argument). 
             First Argument takes a integer to connect to
             server by MDSplus and read the data channels
             or a string being a path to saved data from
-            SaveShot method like.                   """
+            SaveShot method like. engine choose how to
+            take spectrograms: 'batch', 'zoom' or 'mlab', and
+            cache_mb the memory for sweep spectra cache
+            (zero turn it off). lazy memory map saved
+            shots instead of read them (shot_data) and
+            windows is a list of (t1, t2) in ms to take
+            from the server, instead of the whole shot.
+            reference is where the vacuum reference is
+            kept: 'auto', 'shared', a file or None (see
+            module help). peak is how TakeBF take the line
+            of maximum (spectrogram.PEAKS), 'parabolic' or
+            'gaussian' refine it between bins and turn off
+            the zero padding. """
+        # Vacuum reference is always needed.
+        if windows is not None and Tvac is not None:
+            windows = list(windows) + [(Tvac, Tvac)];
         # Critical process to access serve.
-        self.SD = sd.shot_data(shot);
+        if hasattr(shot, 'SweepAt'): self.SD = shot;   # data alredy taken.
+        else: self.SD = sd.shot_data(shot, lazy, windows=windows);
         # Validate the results path.
         if path != '': self.DefinePath(path);
         else:          self.path = path;
         # Imaging properties for spectrograms.
         self.nfft = 2 ** PreviousPow2(float(self.SD.Nsweep) / 5);
         self.fft_step = 2;              # 'walk' 2 points to next window
+        if peak not in sp.PEAKS:
+            raise ValueError('Unknow peak method ' + str(peak));
+        self.peak = peak;
+        # FFT length, zero padding just if the peak is not refined.
+        self.pad_to = 2**12 if peak == 'argmax' else self.nfft;
         self.PF = self.__ProbeFreq();   # Units in always GHz.
-        self.vacBF = self.__TakeVacuumBF(Tvac);
+        if engine not in ('batch', 'zoom', 'mlab'):
+            raise ValueError('Unknow spectrogram engine ' + str(engine));
+        self.engine = engine;
+        if engine == 'zoom':
+            self.spec = sp.ZoomSpecgram(self.nfft, self.fft_step,
+                                        self.SD.rate, self.band, self.pad_to,
+                                        cache_bytes=int(cache_mb * 2**20));
+        else:
+            self.spec = sp.BatchSpecgram(self.nfft, self.fft_step,
+                                         self.SD.rate, self.pad_to,
+                                         cache_bytes=int(cache_mb * 2**20));
+        self.reference = self.__ReferenceFile(reference);
+        self.vacBF = self.__TakeVacuumBF(Tvac) if Tvac is not None else None;
 
     def DefinePath(self, folder):
         """ Define a path on current computer to save data analysis. """
@@ -96,14 +217,12 @@ class SF_analysis:
         except OSError: print warn_msg;
         self.path = FullPath;
 
+    @ins.Timed('near_sweep')
     def NearSweep(self, t):
         """ For t im milliseconds
             Return index of nearst 
             sweep start. """
-        i = time2index(self.SD.rate, t);
-        while (self.SD.trig[i] > 0): i += 1;
-        while (self.SD.trig[i] < 0): i -= 1;
-        return (i + 1);
+        return self.SD.SweepAt(time2index(self.SD.rate, t));
 
     def __ProbeFreq(self):
         # First time centered on first FFT window
@@ -123,8 +242,73 @@ class SF_analysis:
         PF_KA = 3 * (Tsweep * sweepRate + self.SD.fi);
         return np.concatenate([PF_K, PF_KA]);
 
-    def __TakeVacuumBF(self, t): return self.TakeBF(t);
+    def __ReferenceFile(self, reference):
+        """ File of the vacuum reference (None if not kept). 'auto' keeps
+            it in the results path, never in the folder of the shot. """
+        self.shared = reference != 'auto';
+        if reference is None: return None;
+        if reference == 'shared':
+            name = 'sf_%g_%g_%g_%g.npz' % (self.SD.fi, self.SD.ff,
+                                           self.SD.st, self.SD.rate);
+            return os.path.join(ReferenceFolder, name);
+        if reference != 'auto': return reference;
+        if self.path != '': return self.path + ReferenceFile;
+        return None;
 
+    def __ReferenceKey(self, t):
+        """ Settings the vacuum reference depends on. Just the one of
+            'auto' depends on the shot, others may be shared. """
+        key = {'fi': self.SD.fi, 'ff': self.SD.ff, 'st': self.SD.st,
+               'rate': self.SD.rate, 'Nsweep': self.SD.Nsweep, 'Tvac': t,
+               'nfft': self.nfft, 'fft_step': self.fft_step,
+               'pad_to': self.pad_to, 'peak': sp.PEAKS.index(self.peak)};
+        if not self.shared: key['shot'] = self.SD.shot_number;
+        return key;
+
+    @ins.Timed('vacuum')
+    def __TakeVacuumBF(self, t):
+        """ Vacuum beat frequency at t (ms), read from the reference
+            file if made with the same settings, else taken and saved. """
+        if self.reference is None: return self.TakeBF(t);
+        key = self.__ReferenceKey(t);
+        if os.path.isfile(self.reference):
+            data = np.load(self.reference);
+            same = all(k in data.files and np.allclose(data[k], v)
+                       for k, v in key.items());
+            if same:
+                self.PF = data['PF'];
+                self.IKA = int(data['IKA']);
+                vacBF = data['vacBF'];
+                data.close();
+                return vacBF;
+            data.close();
+        vacBF = self.TakeBF(t);
+        self.__SaveReference(key, vacBF);
+        return vacBF;
+
+    def __SaveReference(self, key, vacBF):
+        """ Write the reference in a temporary file and rename, so other
+            processes never read it in half. """
+        folder = os.path.dirname(self.reference);
+        temp = self.reference + '.%d' % os.getpid();
+        try:
+            if folder != '' and not os.path.exists(folder):
+                os.makedirs(folder);
+            f = open(temp, 'wb');
+            np.savez(f, vacBF=vacBF, PF=self.PF, IKA=self.IKA, **key);
+            f.close();
+            os.rename(temp, self.reference);
+        except (IOError, OSError) as err:
+            print '\nCant save vacuum reference: %s' % err;
+
+    def SweepStarts(self, time, count=10):
+        """ Start index of 'count' sweeps from the given time (ms), one
+            each sweep period (st + si) like TakeBF average them. """
+        T_elapse = (self.SD.st + self.SD.si) * 1E-3;
+        return np.array([self.NearSweep(time + j * T_elapse)
+                         for j in range(count)]);
+
+    @ins.Timed('take_bf')
     def TakeBF(self, time, show=False, saveIm=False):
         """ Call signature example: BF = M.TakeBF(70)
             -----------------------------------------
@@ -132,55 +316,67 @@ class SF_analysis:
             Return the beat frequencia of signal to the given instant (time).
             Also is considered a mean of power spectrum of ten sweeps, to
             avoid some resolution problems. """
+        starts = self.SweepStarts(time);
+        S_mean_K, S_mean_KA, f = self.__MeanSpectra(starts);
+        BF = self.__Ridge(S_mean_K, S_mean_KA, f, time);
+        if (saveIm or show):
+            # return to default image inferior limite
+            limSup = np.where(f > 1.55E7)[0].min();
+            limInf = np.where(f < 0.35E7)[0].max();
+            S_K  = S_mean_K[limInf:limSup];
+            S_KA = S_mean_KA[limInf:limSup];
+            f1 = f[limInf]; # Inferior figure limit
+            f2 = f[limSup]; # superior figure limit
+            self.__DrawImage(S_K, S_KA, time, f1, f2, BF, show, saveIm);
+        return BF;
+
+    def __Ridge(self, S_mean_K, S_mean_KA, f, time):
+        """ Beat frequency (Hz) of max line of mean spectra of both bands
+            at time (ms), for each probe frequency of PF. """
+        # avoid useles frequency depends on the case
+        if time < 10: 
+            limSup = np.where(f > 1.65E7)[0].min();
+            limInf = np.where(f < 0.65E7)[0].max();
+        else:
+            limSup = np.where(f > 1.55E7)[0].min();
+            limInf = np.where(f < 0.35E7)[0].max();
+        # Take max line in spectrum (index between bins if refined).
+        freqIndexK  = sp.RidgeIndex(S_mean_K, limInf, limSup, self.peak);
+        freqIndexKA = sp.RidgeIndex(S_mean_KA, limInf, limSup, self.peak);
+        # Take frequency of max line.
+        BF_K  = np.interp(freqIndexK, np.arange(f.size), f);
+        BF_KA = np.interp(freqIndexKA, np.arange(f.size), f);
+        # remove overlap if it has.
+        return np.concatenate([BF_K, BF_KA]);
+
+    @ins.Timed('spectrogram')
+    def __MeanSpectra(self, starts):
+        """ Mean spectrogram of K and Ka bands over sweeps starting at
+            starts, with the engine chosen. Return (S_K, S_KA, f). """
+        length = int(self.SD.st * 1E-6 * self.SD.rate);
+        if self.engine != 'mlab':
+            S, f = self.spec.MeanSpecgram([self.SD.K, self.SD.KA], starts,
+                                          length);
+            return (S[0], S[1], f);
         S_mean_K  = 0.;
         S_mean_KA = 0.;
-        i1 = self.NearSweep(time);
-        i2 = i1 + int(self.SD.st * 1E-6 * self.SD.rate);
-        # time elapsed to next sweep in milliseconds
-        T_elapse = (self.SD.st + self.SD.si) * 1E-3;
         # mean of 10 spectrograms.
-        for j in range(10):
+        for i1 in starts:
+            i2 = i1 + length;
             # K band
             S, f, t = mlab.specgram(self.SD.K[i1:i2], NFFT=self.nfft,
                     Fs=self.SD.rate, noverlap=self.nfft-self.fft_step, 
-                    pad_to=2**12);
+                    pad_to=self.pad_to);
             S_mean_K += S / 10;
             # Ka band
             S, f, t = mlab.specgram(self.SD.KA[i1:i2], NFFT=self.nfft,
                     Fs=self.SD.rate, noverlap=self.nfft-self.fft_step, 
-                    pad_to=2**12);
+                    pad_to=self.pad_to);
             S_mean_KA += S / 10;
-            # update indexes to next sweep.
-            i1 = self.NearSweep(time + T_elapse);
-            i2 = i1 + int(self.SD.st * 1E-6 * self.SD.rate);
-            T_elapse += (self.SD.st + self.SD.si) * 1E-3;
-        # avoid useles frequency depends on the case
-        if time < 10: 
-            limSup = np.where(f > 1.65E7)[0].min();
-            limInf = np.where(f < 0.65E7)[0].max();
-        else:
-            limSup = np.where(f > 1.55E7)[0].min();
-            limInf = np.where(f < 0.35E7)[0].max();
-        # Take max line in spectrum.
-        freqIndexK  = S_mean_K[limInf:limSup].argmax(axis=0) + limInf;
-        freqIndexKA = S_mean_KA[limInf:limSup].argmax(axis=0) + limInf;
-        # return to default image inferior limite
-        limSup = np.where(f > 1.55E7)[0].min();
-        limInf = np.where(f < 0.35E7)[0].max();
-        # Take frequency of max line.
-        BF_K  = f[freqIndexK];
-        BF_KA = f[freqIndexKA];
-        # remove overlap if it has.
-        BF = np.concatenate([BF_K, BF_KA]);
-        if (saveIm or show):
-            S_K  = S_mean_K[limInf:limSup];
-            S_KA = S_mean_KA[limInf:limSup];
-            f1 = f[limInf]; # Inferior figure limit
-            f2 = f[limSup]; # superior figure limit
-            self.__DrawImage(S_K, S_KA, time, f1, f2, BF, show, saveIm);
-        return BF;
+        return (S_mean_K, S_mean_KA, f);
 
-    def EvalGD(self, t, fit_it=False, show=False, saveIm=False):
+    @ins.Timed('eval_gd')
+    def EvalGD(self, t, fit_it=False, show=False, saveIm=False, p0=None):
         """ Call signature example: PF, GD = M.EvalGD(70, booleans...)
             ----------------------------------------------------------
             
@@ -188,72 +384,87 @@ class SF_analysis:
             to resolve initialization problem and take group delay.
             If you go to fit the curve, can take some time and signature
             calling changes with the results parameters include. Use: 
-            PF, GD, Result_fit = M>EvalGD(70, True, True, True) """
+            PF, GD, Result_fit = M>EvalGD(70, True, True, True)
+            p0 are the first guess of the fit, as the params of a
+            near instant (see optimization_gd.fit_GD). """
+        pf, GD = self.GroupDelay(self.TakeBF(t));
+        if(fit_it): # Critical step. Can take more than a minute to fit.
+            result = opt.fit_GD(pf*1E9, GD*1E-9, t, self.path, show, saveIm,
+                                p0=p0);
+            return (pf, GD, result);
+        return (pf, GD);
+
+    def GroupDelay(self, BF):
+        """ Group delay (ns) of beat frequency BF (Hz) on PF, compared
+            with vacuum and cut to the good probe frequencies. BF can be
+            a 2-D array, one row for each instant. Return (pf, GD). """
         # Rate of probe frequency fo each band
         sweepRate = (self.SD.ff - self.SD.fi) / self.SD.st;
         # Restrict K band analyses. Avoid plasma boundary.
         pf, vacBF = self.__GoodBounds(self.vacBF, 19, 25.3);
-        pf, BF = self.__GoodBounds(self.TakeBF(t), 19, 25.3);
+        pf, BF = self.__GoodBounds(BF, 19, 25.3);
         IKA = np.where(pf > 25.3)[0].min(); # New KA start Index
-        GD_K  = 1E-6 * (BF[:IKA] - vacBF[:IKA]) / (2 * sweepRate) + \
-                2 * (self.a + self.R_wall) * 1E9 / self.c;
-        GD_KA = 1E-6 * (BF[IKA:] - vacBF[IKA:]) / (3 * sweepRate) + \
-                2 * (self.a + self.R_wall) * 1E9 / self.c;
-        GD = np.concatenate([GD_K, GD_KA]);
-        if(fit_it): # Critical step. Can take more than a minute to fit.
-            result = opt.fit_GD(pf*1E9, GD*1E-9, t, self.path, show, saveIm);
-            return (pf, GD, result);
+        band = np.where(np.arange(pf.size) < IKA, 2, 3);  # K or Ka factor
+        GD = 1E-6 * (BF - vacBF) / (band * sweepRate) + \
+             2 * (self.a + self.R_wall) * 1E9 / self.c;
         return (pf, GD);
 
+    @ins.Timed('gd_map')
+    def GroupDelayMap(self, t1=None, t2=None, every=1, folder=None,
+                      count=10):
+        """ Call signature example: G = M.GroupDelayMap(50, 100)
+            ----------------------------------------------------
+
+            Beat frequency and group delay of the whole shot (or from t1
+            to t2 in ms) for blocks of 'count' sweeps, as TakeBF, starting
+            at each 'every' sweeps. Consecutive blocks share sweeps, so
+            keep the spectra cache on (cache_mb). Results are written in a
+            GroupDelayMap (gd_map.py) of folder, default gd_map/ in the
+            results path. Blocks out of the windows taken are NaN. """
+        starts = np.asarray(self.SD.sweep_start);
+        times = self.SD.Time(starts);
+        k = np.arange(starts.size - count + 1);
+        if t1 is not None: k = k[times[k] >= t1];
+        if t2 is not None: k = k[times[k] <= t2];
+        k = k[::every];
+        if folder is None: folder = self.path + 'gd_map/';
+        pf = self.__GoodBounds(self.PF, 19, 25.3)[0];
+        G = gm.CreateMap(folder, times[k], self.PF, pf,
+                         self.SD.shot_number);
+        print '\nGroup delay map of %d blocks, can take a while...' % k.size
+        for row, j in enumerate(k):
+            try:
+                S_K, S_KA, f = self.__MeanSpectra(starts[j:j + count]);
+                G.bf[row] = self.__Ridge(S_K, S_KA, f, times[j]);
+            except IndexError: G.bf[row] = np.nan;
+        # All group delays at once, by blocks of rows.
+        for r1 in range(0, k.size, 1024):
+            G.gd[r1:r1 + 1024] = self.GroupDelay(G.bf[r1:r1 + 1024])[1];
+        G.Flush();
+        return G;
+
+    @ins.Timed('good_bounds')
     def __GoodBounds(self, bf, f1, f2):
-        """ Method to cut problematic data """
+        """ Method to cut problematic data (last axis of bf) """
         i1_K = np.where(self.PF <= f1)[0].max();
         i2_K = np.where(self.PF <= f2)[0].max();
         pf_K = self.PF[i1_K:i2_K];
         pf_Ka = self.PF[self.IKA:];
-        bf_K = bf[i1_K:i2_K];
-        bf_Ka = bf[self.IKA:];
+        bf_K = bf[..., i1_K:i2_K];
+        bf_Ka = bf[..., self.IKA:];
         good_pf = np.concatenate([pf_K, pf_Ka]);
-        good_bf = np.concatenate([bf_K, bf_Ka]);
+        good_bf = np.concatenate([bf_K, bf_Ka], axis=-1);
         return (good_pf, good_bf);
 
+    @ins.Timed('bf_figure')
     def __DrawImage(self, S_K, S_Ka, time, bf_inf, bf_sup, bf, show, saveIm):
-        # Scale to simple units.
-        pf      = self.PF;
-        BF_sup  = bf_sup / 1E6;
-        BF_inf  = bf_inf / 1E6;
-        BF      = bf / 1E6;
-        # image displayed one side for each band.
-        f, (ax1, ax2) = plt.subplots(1, 2, sharey=True, figsize=(18, 8));
-        # Draw Spectrum of K band.
-        ax1.imshow(np.log(S_K), origin='lower', aspect='auto', \
-                extent=[pf[0], pf[self.IKA-1], BF_inf, BF_sup]);
-        # Draw Spectrum of Ka band.
-        ax2.imshow(np.log(S_Ka), origin='lower', aspect='auto', \
-                extent=[pf[self.IKA], pf[-1], BF_inf, BF_sup]);
-        # Draw line of maximum for each spectrum.
-        ax1.plot(pf[:self.IKA], BF[:self.IKA], 'k-', linewidth=2);
-        ax2.plot(pf[self.IKA:], BF[self.IKA:], 'k-', linewidth=2);
-        # Figure limits.
-        f.subplots_adjust(wspace=0.02);
-        ax1.set_xlim(pf[0], pf[self.IKA-1]);
-        ax1.set_ylim(BF_inf, BF_sup);
-        ax2.set_xlim(pf[self.IKA], pf[-1]);
-        ax2.set_ylim(BF_inf, BF_sup);
-        # Figure labels (x comom label)
-        ax1.set_ylabel('Beat Frequency (MHz)', fontsize=16);
-        f.text(0.5, 0.03, 'Probe Frequency (GHz)', ha='center', fontsize=16);
-        ax1.set_title('\"K\" band', fontsize=16); 
-        ax2.set_title('\"Ka\" Band', fontsize=16);
         # Switch case if vacuum or plasma to choose a name.
         if time > 10 : 
             figName = '#' + str(self.SD.shot_number) + '_%.2f.jpg' % time
         else : 
             figName = '#' + str(self.SD.shot_number) + '_vacuum.jpg'
-        if saveIm: 
-            f.savefig(self.path + figName, dpi=150, bbox_inches='tight');
-        # if required display image.
-        if (show): plt.show(f);
-        else:      plt.close(f);
+        figName = self.path + figName if saveIm else None;
+        render.Draw(DrawSpectra, S_K, S_Ka, self.PF, self.IKA, bf_inf, bf_sup,
+                    bf, figName, show=show);
 
-    def SaveShot(self, path=''): self.SD.SaveShot(path);
+    def SaveShot(self, path='', fmt='npy'): self.SD.SaveShot(path, fmt);
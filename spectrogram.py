@@ -0,0 +1,323 @@
+"""
+
+Python Module of Functions
+------ ------ -- ---------
+
+Dependencies: numpy, scipy.fftpack.
+-------------
+
+Description :
+-----------
+
+    Batched spectrogram engine used by signal_analyse.TakeBF. Instead of
+    one mlab.specgram call for each sweep and band, all sweeps of all
+    bands are stacked and seen through one strided view of windows, that
+    is transformed with real FFTs in blocks of bounded size. The window,
+    the zero padded input buffer and the accumulator are kept between
+    calls. The power spectrum has the same scale of mlab.specgram (psd
+    mode, hanning window, no detrend, one sided).
+
+    Optionally (cache_bytes > 0) the power of each sweep is kept in a least
+    recently used cache, and the mean of consecutive calls is updated as a
+    rolling window: sweeps that left are subtracted, new ones are added.
+
+    RidgeIndex takes the line of maximum of a spectrogram. Besides the bin
+    of maximum (argmax), it can refine it between bins with a parabola
+    through the bin and its neighbours, of the power ('parabolic') or of
+    its log ('gaussian'), so the spectra dont need zero padding to give
+    a fine frequency (pad_to = nfft).
+
+    ZoomSpecgram takes just the band where the beat frequency is. Each
+    window (not padded) is multiplied by the matrix of the DFT at the bins
+    of pad_to points FFT inside the band, with BLAS. The cost goes with
+    nfft times the bins of the band instead of pad_to log(pad_to), and the
+    spectra and cache have just the band.
+
+Example to Use:
+------- -- ----
+
+    >>> import spectrogram as sp
+    >>> B = sp.BatchSpecgram(nfft, step, rate, pad_to=2**12)
+    >>> # or just the band 3 to 17 MHz (ZoomSpecgram), same use.
+    >>> B = sp.ZoomSpecgram(nfft, step, rate, (3E6, 17E6), pad_to=2**12)
+    >>> S, f = B.MeanSpecgram([K, KA], starts, length)
+    >>> # S[0] is the mean over sweeps of K band, S[1] of KA band.
+    >>> k = sp.RidgeIndex(S[0], lo, hi, 'gaussian')  # rows lo to hi
+    >>> bf = np.interp(k, np.arange(f.size), f)
+
+Developed by: Alex Andriati - USP
+
+"""
+
+import numpy as np, scipy.fftpack as fftpack
+from numpy.lib.stride_tricks import as_strided
+from collections import OrderedDict, Counter
+
+PEAKS = ['argmax', 'parabolic', 'gaussian'];
+
+def RidgeIndex(S, lo, hi, peak='argmax'):
+    """ Row of maximum of each column of S (frequency x window) between
+        rows lo and hi. With 'parabolic' or 'gaussian' it is a float, the
+        vertex of the parabola through the maximum and its neighbours of
+        S or log(S). The log is exact for a gaussian peak and close to a
+        hanning window lobe. """
+    if peak not in PEAKS: raise ValueError('Unknow peak method ' + str(peak));
+    k = S[lo:hi].argmax(axis=0) + lo;
+    if peak == 'argmax': return k;
+    cols = np.arange(S.shape[1]);
+    inner = (k > 0) & (k < S.shape[0] - 1);    # has both neighbours.
+    kk = np.clip(k, 1, S.shape[0] - 2);
+    y = [S[kk - 1, cols], S[kk, cols], S[kk + 1, cols]];
+    if peak == 'gaussian':
+        y = [np.log(np.maximum(v, np.finfo(float).tiny)) for v in y];
+    den = y[0] - 2 * y[1] + y[2];
+    ok = inner & (den < 0);
+    delta = np.zeros(k.size);
+    delta[ok] = 0.5 * (y[0][ok] - y[2][ok]) / den[ok];
+    return k + np.clip(delta, -0.5, 0.5);
+
+class SpectrumCache:
+    """ Least recently used cache of per sweep power spectra, limited
+        to max_bytes of memory. Count hits and misses of Get. """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes;
+        self.nbytes = 0;
+        self.hits = 0;
+        self.misses = 0;
+        self._data = OrderedDict();
+
+    def __contains__(self, key): return key in self._data;
+
+    def __len__(self): return len(self._data);
+
+    def Get(self, key):
+        """ Return the spectrum of key or None. """
+        if key not in self._data:
+            self.misses += 1;
+            return None;
+        self.hits += 1;
+        value = self._data.pop(key);
+        self._data[key] = value;    # most recently used at the end.
+        return value;
+
+    def Put(self, key, value):
+        """ Keep value, dropping the least recently used if needed. """
+        if key in self._data: self.nbytes -= self._data.pop(key).nbytes;
+        if value.nbytes > self.max_bytes: return;
+        self._data[key] = value;
+        self.nbytes += value.nbytes;
+        while self.nbytes > self.max_bytes:
+            self.nbytes -= self._data.popitem(last=False)[1].nbytes;
+
+    def Clear(self):
+        self._data.clear();
+        self.nbytes = 0;
+
+class BatchSpecgram:
+    """ Mean power spectrogram over many sweeps of many bands at once.
+
+        nfft ----> points of each window.
+        step ----> points between consecutive windows (nfft - noverlap).
+        rate ----> sample rate in Hz.
+        pad_to --> length of each FFT (windows are padded with zeros).
+        block ---> maximum size of the FFT input buffer (samples).
+        cache_bytes -> memory for the per sweep cache (0 turn it off).
+        refresh -> rolling updates before the sum is taken from scratch.
+    """
+
+    def __init__(self, nfft, step, rate, pad_to=2**12, block=2**22,
+                 cache_bytes=0, refresh=50):
+        self.nfft   = nfft;
+        self.step   = step;
+        self.rate   = float(rate);
+        self.pad_to = pad_to;
+        self.block  = block;
+        self.window = np.hanning(nfft);
+        bins = self._Bins();
+        self.freqs  = bins * self.rate / pad_to;
+        # Same scale of mlab: one sided density divided by the rate and
+        # by the window norm. DC (and last bin if nfft is even) not doubled.
+        single = (bins == 0) | ((nfft % 2 == 0) & (bins == pad_to // 2));
+        self.scale = np.where(single, 1.0, 2.0);
+        self.scale /= self.rate * (self.window**2).sum();
+        width = self._Width();
+        self._buf = np.zeros([max(1, block // width), width]);
+        self._acc = None;
+        # Per sweep cache and rolling sum of the last call.
+        self.cache = SpectrumCache(cache_bytes) if cache_bytes > 0 else None;
+        self.refresh = refresh;
+        self._keys = None;
+        self._sum = None;
+        self._updates = 0;
+
+    def Windows(self, signals, starts, length):
+        """ Stack 'length' points from each start of each signal and
+            return a strided view (bands, sweeps, windows, nfft). """
+        idx = np.asarray(starts)[:, None] + np.arange(length);
+        seg = np.array([np.asarray(x[idx]) for x in signals], dtype=float);
+        nwin = (length - self.nfft) // self.step + 1;
+        st = seg.strides;
+        return as_strided(seg, shape=(seg.shape[0], seg.shape[1], nwin,
+                          self.nfft), strides=(st[0], st[1],
+                          st[2] * self.step, st[2]));
+
+    def MeanSpecgram(self, signals, starts, length):
+        """ Return (S, f) where S[b] is the mean over all starts of the
+            spectrogram (frequency x window) of signals[b] and f are the
+            frequencies in Hz. With the cache turned on the mean is
+            updated from the previous call (see RollingSum). """
+        if self.cache is not None:
+            total = self.RollingSum(signals, starts, length);
+            S = total * (self.scale / len(starts));
+            return (S.transpose(0, 2, 1), self.freqs);
+        view = self.Windows(signals, starts, length);
+        bands, sweeps, nwin, nfft = view.shape;
+        # Squares of the packed real FFT are summed over sweeps, pairs
+        # (Re^2 + Im^2) are joined just once at the end.
+        packed = self._Packed();
+        if self._acc is None or self._acc.shape != (bands, nwin, packed):
+            self._acc = np.empty([bands, nwin, packed]);
+        self._acc[:] = 0;
+        for b in range(bands):
+            for s0, s1, Y2 in self._Blocks(view[b]):
+                self._acc[b] += Y2.sum(axis=0);
+        S = self._Unpack(self._acc) * (self.scale / sweeps);
+        return (S.transpose(0, 2, 1), self.freqs);
+
+    def RollingSum(self, signals, starts, length):
+        """ Sum over starts of the unscaled power (bands, windows, freqs)
+            of each sweep, taken from the cache. If the previous call
+            shares sweeps with this one, just the sweeps that left and
+            entered are subtracted and added. Each 'refresh' updates the
+            sum is taken again from scratch to avoid round off drift. """
+        keys = [(b, int(i), length) for b in range(len(signals))
+                for i in starts];
+        old = Counter(self._keys or []);
+        new = Counter(keys);
+        removed = list((old - new).elements());
+        added = list((new - old).elements());
+        rolling = (self._sum is not None and self._updates < self.refresh
+                   and len(removed) + len(added) < len(keys)
+                   and all(k in self.cache for k in removed));
+        if rolling:
+            total = self._sum;
+            for k, power in zip(added, self.SweepPower(signals, added)):
+                total[k[0]] += power;
+            for k, power in zip(removed, self.SweepPower(signals, removed)):
+                total[k[0]] -= power;
+            self._updates += 1;
+        else:
+            total = None;
+            for k, power in zip(keys, self.SweepPower(signals, keys)):
+                if total is None:
+                    total = np.zeros((len(signals),) + power.shape);
+                total[k[0]] += power;
+            self._updates = 0;
+        self._keys = keys;
+        self._sum = total;
+        return total;
+
+    def SweepPower(self, signals, keys):
+        """ Unscaled power (windows, freqs) of each key (band, start,
+            length). Take it from the cache or compute the missing ones
+            in batch and keep them there. """
+        found = [self.cache.Get(k) for k in keys];
+        missing = sorted(set(k for k, v in zip(keys, found) if v is None));
+        computed = {};
+        for b in set(k[0] for k in missing):
+            for length in set(k[2] for k in missing if k[0] == b):
+                group = [k for k in missing if k[0] == b and k[2] == length];
+                view = self.Windows([signals[b]], [k[1] for k in group],
+                                    length)[0];
+                for s0, s1, Y2 in self._Blocks(view):
+                    for j in range(s1 - s0):
+                        power = self._Unpack(Y2[j]);
+                        computed[group[s0 + j]] = power;
+                        self.cache.Put(group[s0 + j], power);
+        return [v if v is not None else computed[k]
+                for k, v in zip(keys, found)];
+
+    def _Bins(self):
+        """ Bins of a pad_to points FFT that are computed. """
+        return np.arange(self.pad_to // 2 + 1);
+
+    def _Width(self):
+        """ Points of each window in the input buffer (with zeros). """
+        return self.pad_to;
+
+    def _Packed(self):
+        """ Length of the output of _Transform for each window. """
+        return self.pad_to;
+
+    def _Transform(self, buf):
+        """ Squares of the packed real FFT of each row of buf. """
+        Y = fftpack.rfft(buf, axis=1);
+        Y *= Y;
+        return Y;
+
+    def _Blocks(self, view):
+        """ Yield (s0, s1, Y2) for blocks of whole sweeps of one band,
+            where Y2 (sweeps, windows, packed) are the squares of the
+            transform of each window (_Transform). """
+        sweeps, nwin, nfft = view.shape;
+        per_block = max(1, self._buf.shape[0] // nwin);
+        if per_block * nwin > self._buf.shape[0]:
+            self._buf = np.zeros([per_block * nwin, self._Width()]);
+        for s0 in range(0, sweeps, per_block):
+            s1 = min(s0 + per_block, sweeps);
+            buf = self._buf[:(s1 - s0) * nwin];
+            out = buf[:, :nfft].reshape(s1 - s0, nwin, nfft);
+            np.multiply(view[s0:s1], self.window, out=out);
+            Y = self._Transform(buf);
+            yield (s0, s1, Y.reshape(s1 - s0, nwin, -1));
+
+    def _Unpack(self, Y2):
+        """ Power for frequencies 0 to rate/2 from squares of fftpack.rfft
+            output, packed as [y0, Re y1, Im y1, ..., Re y(n/2)]. """
+        power = np.empty(Y2.shape[:-1] + (self.freqs.size,));
+        power[..., 0] = Y2[..., 0];
+        if self.pad_to % 2:
+            power[..., 1:] = Y2[..., 1::2] + Y2[..., 2::2];
+        else:
+            power[..., 1:-1] = Y2[..., 1:-1:2] + Y2[..., 2:-1:2];
+            power[..., -1] = Y2[..., -1];
+        return power;
+
+class ZoomSpecgram(BatchSpecgram):
+    """ BatchSpecgram of just the band (f1, f2) in Hz, on the frequencies
+        of a pad_to points FFT. Instead of the whole padded FFT each window
+        is multiplied by the matrix of the DFT at the bins of the band
+        (a zoom transform), so the input buffer has no zeros and spectra
+        have just the band. Values are the same of BatchSpecgram there. """
+
+    def __init__(self, nfft, step, rate, band, pad_to=2**12, block=2**22,
+                 cache_bytes=0, refresh=50):
+        self.band = band;
+        self.pad_to = pad_to;
+        self.rate = float(rate);
+        bins = self._Bins();
+        phase = 2 * np.pi * np.outer(np.arange(nfft), bins) / pad_to;
+        # Real and imaginary parts side by side, joined by _Unpack.
+        self._dft = np.hstack([np.cos(phase), np.sin(phase)]);
+        BatchSpecgram.__init__(self, nfft, step, rate, pad_to, block,
+                               cache_bytes, refresh);
+
+    def _Bins(self):
+        # Bins around the band and one more each side (peak neighbours).
+        k1 = int(np.floor(self.band[0] * self.pad_to / self.rate)) - 1;
+        k2 = int(np.ceil(self.band[1] * self.pad_to / self.rate)) + 1;
+        return np.arange(max(k1, 0), min(k2, self.pad_to // 2) + 1);
+
+    def _Width(self): return self.window.size;
+
+    def _Packed(self): return self._dft.shape[1];
+
+    def _Transform(self, buf):
+        Y = np.dot(buf, self._dft);
+        Y *= Y;
+        return Y;
+
+    def _Unpack(self, Y2):
+        half = Y2.shape[-1] // 2;
+        return Y2[..., :half] + Y2[..., half:];
@@ -0,0 +1,225 @@
+"""
+
+PYTHON CLASS & MODULE
+------ ----- - ------
+
+Dependencies : os, time, numpy, shot_data, signal_analyse.
+------------
+
+    Analysis of a sweep frequency shot while its samples arrive, during
+    or just after the discharge. Chunks of K, KA and trigger samples (from
+    a generator, a growing file, ...) are appended to a StreamData, that
+    behaves like shot_data for SF_analysis: channels are indexed by the
+    indices of the whole record but just the last samples are kept, and
+    sweep starts are found as the trigger edges arrive.
+
+    SF_stream takes blocks of 'count' consecutive sweeps (the ten sweeps
+    averaged by TakeBF) as soon as they are complete and yields the group
+    delay of each one. Samples before the block in analysis are dropped,
+    so memory is bounded by a block plus a chunk (and the spectra cache).
+    The vacuum reference is taken when the data of Tvac arrive, blocks
+    before it are skipped.
+
+HOW TO USE :
+------------
+
+    >>> import streaming as st
+    >>> chunks = st.GrowingFiles(['K.raw', 'KA.raw', 'trigger.raw'])
+    >>> S = st.SF_stream(params, chunks)    # params as ShotFile.params
+    >>> for t, pf, GD in S.Results(): print t, GD.mean()
+
+    A saved shot can be replayed with ArrayChunks(s.K, s.KA, s.trig).
+
+Developed by: Alex Andriati - USP.
+
+"""
+
+import os, time;
+import numpy as np;
+import shot_data as sd;
+import signal_analyse as sa;
+
+def ArrayChunks(K, KA, trig, chunk=2**18):
+    """ Yield (K, KA, trig) chunks of 'chunk' samples of whole arrays. """
+    for i in range(0, len(K), chunk):
+        yield (np.asarray(K[i:i + chunk]), np.asarray(KA[i:i + chunk]),
+               np.asarray(trig[i:i + chunk]));
+
+def GrowingFiles(paths, dtype='<i2', chunk=2**18, poll=0.05, timeout=5.0):
+    """ Yield (K, KA, trig) chunks of raw files (paths in this order) that
+        are still being written. Stop when no sample arrives for 'timeout'
+        seconds. Samples are yielded when all channels have them. """
+    itemsize = np.dtype(dtype).itemsize;
+    files = [open(p, 'rb') for p in paths];
+    read = 0;
+    last = time.time();
+    try:
+        while True:
+            sizes = [os.fstat(f.fileno()).st_size // itemsize for f in files];
+            n = min(min(sizes) - read, chunk);
+            if n <= 0:
+                if time.time() - last > timeout: return;
+                time.sleep(poll);
+                continue;
+            data = [np.fromstring(f.read(n * itemsize), dtype=dtype)
+                    for f in files];
+            read += n;
+            last = time.time();
+            yield tuple(x.astype(float) for x in data);
+    finally:
+        for f in files: f.close();
+
+class StreamChannel:
+    """ Last samples of a channel still arriving, indexed by the indices
+        of the whole record (integer, slice or array of integers). Samples
+        dropped or not arrived yet raise IndexError. """
+
+    def __init__(self):
+        self.first = 0;
+        self.data = np.zeros(0);
+
+    def __len__(self): return self.first + self.data.size;
+
+    def Append(self, x):
+        self.data = np.concatenate([self.data, x]);
+
+    def Drop(self, i):
+        """ Forget samples before i. """
+        if i > self.first:
+            self.data = self.data[i - self.first:].copy();
+            self.first = i;
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self));
+            i1 = start; i2 = stop;
+        else:
+            i = np.asarray(i);
+            if i.size == 0: return np.zeros(i.shape);
+            i1 = int(i.min()); i2 = int(i.max()) + 1;
+        if i1 < self.first or i2 > len(self):
+            raise IndexError('Samples %d to %d are not in the stream'
+                             % (i1, i2));
+        if isinstance(i, slice):
+            return self.data[start - self.first:stop - self.first:step];
+        return self.data[i - self.first];
+
+class StreamData:
+    """ Data of a sweep frequency shot still arriving, with the interface
+        of shot_data used by SF_analysis. params is a dictionary with rate,
+        st, si, fi and ff (as ShotFile.params). """
+
+    def __init__(self, params, shot_number=11111):
+        self.mode = 'sf';
+        self.shot_number = shot_number;
+        self.rate = float(params['rate']);
+        self.st = params['st'];
+        self.si = params['si'];
+        self.fi = params['fi'];
+        self.ff = params['ff'];
+        self.sample = int(params.get('sample', 0));
+        self.angle = params.get('angle', 0.0);
+        self.Nsweep = int(1E-6 * self.st * self.rate);
+        self.K = StreamChannel();
+        self.KA = StreamChannel();
+        self.trig = StreamChannel();
+        self.T = sd.TimeAxis(0, self.rate);
+        self.sweep_start = np.zeros(0, dtype=int);
+        self.sweep_count = 0;
+
+    def __len__(self): return len(self.trig);
+
+    def Append(self, K, KA, trig):
+        """ Add samples of each channel and index sweeps that started. """
+        size = len(self.trig);
+        trig = np.asarray(trig, dtype=float);
+        if self.trig.data.size > 0:     # edge may be between chunks.
+            x = np.concatenate([self.trig.data[-1:], trig]);
+            edges = sd.SweepEdges(x, size - 1, False);
+        else: edges = sd.SweepEdges(trig, size, size == 0);
+        self.K.Append(np.asarray(K, dtype=float));
+        self.KA.Append(np.asarray(KA, dtype=float));
+        self.trig.Append(trig);
+        self.T.size = len(self.trig);
+        self.sweep_start = np.concatenate([self.sweep_start, edges]);
+        self.sweep_count = self.sweep_start.size;
+
+    def Drop(self, i):
+        """ Forget samples and sweeps before sample i. """
+        for x in [self.K, self.KA, self.trig]: x.Drop(i);
+        self.sweep_start = self.sweep_start[self.sweep_start >= i];
+        self.sweep_count = self.sweep_start.size;
+
+    def SweepAt(self, i):
+        """ Index of the sweep start near sample i, like shot_data. """
+        j = np.searchsorted(self.sweep_start, i, 'right');
+        if self.trig[i] < 0:
+            if j == 0: raise IndexError('Start of sweep was dropped');
+            return self.sweep_start[j - 1];
+        if j >= self.sweep_count: raise IndexError('No sweep after %d' % i);
+        return self.sweep_start[j];
+
+    def Time(self, i):
+        """ Time in milliseconds of sample(s) i. """
+        return 1E3 * np.asarray(i) / self.rate;
+
+class SF_stream:
+    """ Group delay of blocks of 'count' sweeps of a shot while it arrives.
+        chunks is an iterable of (K, KA, trig) arrays. Other arguments go
+        to SF_analysis (M attribute), fit_it also fit the profile, each
+        fit started from the params of the previous block. """
+
+    def __init__(self, params, chunks, Tvac=2, count=10, fit_it=False,
+                 shot_number=11111, path='', engine='batch', cache_mb=64):
+        self.SD = StreamData(params, shot_number);
+        self.M = sa.SF_analysis(self.SD, path, None, engine, cache_mb);
+        self.chunks = chunks;
+        self.Tvac = Tvac;
+        self.count = count;
+        self.fit_it = fit_it;
+        self.length = int(self.SD.st * 1E-6 * self.SD.rate);
+        self.next = 0;      # first sample of next block.
+        self.p0 = None;     # params of last fit.
+
+    def Results(self):
+        """ Yield (t, pf, GD) of each block of sweeps (t in ms) as soon as
+            its samples arrive, or (t, pf, GD, result) with fit_it. """
+        for K, KA, trig in self.chunks:
+            self.SD.Append(K, KA, trig);
+            while self.__Ready(self.count + 1):
+                result = self.__Block();
+                if result is not None: yield result;
+        # End of shot: last block has no sweep after it.
+        if self.__Ready(self.count):
+            try:
+                result = self.__Block();
+                if result is not None: yield result;
+            except IndexError: pass;
+
+    def __Ready(self, sweeps):
+        """ True if 'sweeps' sweeps from the next block have arrived. """
+        starts = self.SD.sweep_start[self.SD.sweep_start >= self.next];
+        if starts.size < sweeps: return False;
+        return starts[sweeps - 1] + self.length <= len(self.SD);
+
+    def __Block(self):
+        """ Group delay of next block, None before the vacuum reference.
+            Samples before the following block are dropped. """
+        starts = self.SD.sweep_start[self.SD.sweep_start >= self.next];
+        t = self.SD.Time(starts[0]);
+        following = (starts[self.count] if starts.size > self.count
+                     else starts[-1] + self.length);
+        result = None;
+        if t >= self.Tvac:
+            if self.M.vacBF is None: self.M.vacBF = self.M.TakeBF(self.Tvac);
+            result = (t,) + self.M.EvalGD(t, self.fit_it, p0=self.p0);
+            if self.fit_it: self.p0 = result[-1]['params'];
+        self.next = following;
+        # One period before is kept (time to index round off), and the
+        # vacuum samples until the reference is taken.
+        period = int(1E-6 * (self.SD.st + self.SD.si) * self.SD.rate);
+        keep = self.next - period;
+        if self.M.vacBF is None:
+            keep = min(keep, sa.time2index(self.SD.rate, self.Tvac) - period);
+        self.SD.Drop(max(0, keep));
+        return result;
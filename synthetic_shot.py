@@ -0,0 +1,112 @@
+"""
+
+PYTHON CLASS & MODULE
+------ ----- - ------
+
+Dependencies : numpy, gaussian_hat, shot_data.
+------------
+
+    Synthetic sweep frequency shots, to test and measure the package
+    without the server. The trigger is negative during each sweep (st us)
+    and positive in the interval (si us), with a small noise. The probe
+    frequency of the source goes from fi to ff during the sweep and the
+    K and Ka bands multiply it by 2 and 3. The beat signal of each sweep
+    has the frequency given by the group delay of the density profile of
+    that instant (gaussian_hat model) plus the line delay, with white noise
+    and the samples are quantized like a digitizer.
+
+    SyntheticShot is a shot_data, so it can be analysed directly or saved
+    in the folders of SaveShot (npy or rfz) to be read later.
+
+HOW TO USE :
+------------
+
+    >>> import synthetic_shot as ss
+    >>> s = ss.SyntheticShot(ms=14.0, noise=0.3)
+    >>> s.SaveShot('/tmp')                  # /tmp/#99999/
+    >>> M = sa.SF_analysis('/tmp/#99999/', Tvac=1)
+
+    Other profiles are given by a function of time (ms) that return the
+    params (n0, alpha, A, s) of gaussian_hat, or None for vacuum.
+
+    $ python synthetic_shot.py path [ms]
+
+Developed by: Alex Andriati - USP.
+
+"""
+
+import sys;
+import numpy as np;
+import gaussian_hat as gh;
+import shot_data as sd;
+
+Rwall = 0.22;
+
+def DefaultProfile(t):
+    """ Vacuum until 5 ms, then a profile with center density changing
+        slowly in time. """
+    if t < 5: return None;
+    return (1.0E19 * (1 + 0.2 * np.sin(t)), 1.5, 0.6, 0.05);
+
+class SyntheticShot(sd.shot_data):
+    """ Sweep frequency shot made from a density profile function of time.
+
+        ms -------> length of the shot in milliseconds.
+        rate -----> sample rate in Hz.
+        st, si ---> sweep time and interval between sweeps (us).
+        fi, ff ---> start and end frequency of the source (GHz).
+        profile --> function of time (ms), see DefaultProfile.
+        noise ----> standard deviation of noise (signal amplitude 1).
+        delay ----> delay of lines and waveguides (ns).
+        bits -----> digitizer resolution (None keep floats).
+        offset ---> samples of the first sweep before the record starts.
+    """
+
+    def __init__(self, ms=14.0, rate=2E8, st=8.0, si=2.0, fi=9.0, ff=13.25,
+                 profile=DefaultProfile, noise=0.3, delay=9.0, bits=14,
+                 offset=137, shot_number=99999, seed=0):
+        rs = np.random.RandomState(seed);
+        self.shot_number = shot_number;
+        self.windows = None;
+        self.mode = 'sf';
+        self.rate = rate; self.angle = 0.0;
+        self.st = st; self.si = si; self.fi = fi; self.ff = ff;
+        self.Nsweep = int(1E-6 * st * rate);
+        size = int(ms * 1E-3 * rate);
+        self.sample = size;
+        period = int(1E-6 * (st + si) * rate);
+        sweeps = (size + offset) // period + 1;
+        # Time in sweep (us), frequency kept at ff in the interval.
+        tau = np.minimum(np.arange(period), self.Nsweep) / rate * 1E6;
+        fsrc = fi + (ff - fi) / st * tau;
+        t0 = 1E3 * (np.arange(sweeps) * period - offset) / rate;
+        trig = np.where(np.arange(period) < self.Nsweep, -1.0, 1.0);
+        trig = np.tile(trig, sweeps)[offset:offset + size];
+        self.trig = self.__Digitize(trig + 0.05 * rs.randn(size), bits);
+        vac = 2 * (gh.a + Rwall) / gh.c * 1E9;      # ns
+        for name, factor in [('K', 2), ('KA', 3)]:
+            bf = np.empty([sweeps, period]);
+            for j in range(sweeps):
+                params = profile(t0[j]);
+                if params is None: gd = vac;
+                else: gd = 1E9 * gh.OptGroupDelay(factor * fsrc * 1E9,
+                                                   *params);
+                # Beat frequency (Hz) of this sweep, GHz/us times ns.
+                bf[j] = factor * (ff - fi) / st * 1E6 * (delay + gd - vac);
+            phase = 2 * np.pi * np.cumsum(bf.ravel()[offset:offset + size]);
+            x = np.sin(phase / rate) + noise * rs.randn(size);
+            setattr(self, name, self.__Digitize(x, bits));
+        self.T = sd.TimeAxis(size, rate);
+        self.sweep_start = sd.SweepEdges(self.trig);
+        self.sweep_count = self.sweep_start.size;
+
+    def __Digitize(self, x, bits):
+        """ Round x to the levels of a digitizer of 'bits' in [-2, 2). """
+        if bits is None: return x;
+        step = 4.0 / 2**bits;
+        q = np.clip(np.round(x / step), -2**(bits - 1), 2**(bits - 1) - 1);
+        return q * step;
+
+if __name__ == '__main__':
+    ms = float(sys.argv[2]) if len(sys.argv) > 2 else 14.0;
+    SyntheticShot(ms).SaveShot(sys.argv[1]);
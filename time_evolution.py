@@ -3,10 +3,11 @@
 Python Script
 ------ ------
 
-Dependencies: numpy, signal_analyse, sys.
+Dependencies: numpy, signal_analyse, sys, os, time, multiprocessing,
+              model_library, scan_store.
 -------------
 
-Execution: $ python time_evolution shot_number t0 tf dt
+Execution: $ python time_evolution shot_number t0 tf dt [workers]
 ----------
 
     Evaluate Group Delay by optimized curve fitted method. Get just the
@@ -16,14 +17,78 @@ Execution: $ python time_evolution shot_number t0 tf dt
     to -----------> Initial instant in miliseconds
     tf -----------> final instant in miliseconds
     dt -----------> time interval between calculations
+    workers ------> number of processes to fit in parallel (default 1)
+
+    With more than one worker the shot is loaded just once, before the
+    worker processes are forked, so they share its memory (copy on write)
+    and each task carries only the instant. Results are written in time
+    order as they are ready, and a failed fit doesnt stop the others.
+
+    Each fit starts from the params of the previous instant fitted by the
+    same process (warm start), when it is at most 1.5 dt before. If that
+    fails, or there is no previous instant, it starts from the nearest
+    curve of the group delay library (model_library.py, built and saved
+    the first time for the probe frequencies of the shot) and last from
+    the usual guess.
+
+    Each instant is appended, as soon as it is done, to the scan store of
+    the shot (scan_store.py, folder scan/ in the results): params,
+    covariance, residuals, convergence (failed fits too), evaluations and
+    time taken. Instants already in the store (failed ones too) are
+    skipped, so a scan that died is run again with the same arguments and
+    goes on where it was. At the end the results file is written from the
+    store (all its instants from t0 to tf), with time, n_max and its
+    error, model and jacobian evaluations of each fit and 1 if it was warm
+    started (0 otherwise). Totals are printed at the end.
+
+    To know where the time goes set REFLECTOMETRY_INSTRUMENT to a json
+    file name. Stage times and call counts of each instant and the totals
+    (see instrument.py) are written there at the end.
+
+    Figures are rendered by background processes (render.py), workers
+    send theirs to this process with the results. Labels use mathtext
+    (fast, see render.py). Set REFLECTOMETRY_FIGURES to 'none' to skip
+    them, or 'latex' for LaTeX labels.
 
 Developed by: Alex Andriati - USP
 
 """
 
-import sys;
-from numpy import arange, sqrt;
+import sys, os, time;
+from numpy import arange;
+from multiprocessing import Pool;
+import matplotlib; matplotlib.use('Agg'); # figures are only saved.
 import signal_analyse as sa;
+import instrument as ins;
+import model_library as ml;
+import scan_store as ss;
+import render;
+
+# Mathtext labels unless asked, LaTeX takes too long for a scan.
+render.Configure(os.environ.get('REFLECTOMETRY_FIGURES', 'mathtext'));
+
+report = os.environ.get('REFLECTOMETRY_INSTRUMENT');
+if report: ins.Enable();
+
+# Last instant fitted and its params in this process (warm start).
+last = [None, None];
+
+def FitInstant(t):
+    """ Fit Group Delay at instant t with the global analysis M.
+        Return (t, result, seconds, record, figures) with result None if
+        the fit doesnt converge, seconds taken, record of instrument (empty
+        if not enabled) and figures deferred in workers (see render.Defer).
+    """
+    print '\nInstante = %.3fms' %t;
+    p0 = last[1] if last[0] is not None and abs(t - last[0]) <= 1.5 * dt \
+         else None;
+    start = time.time();
+    with ins.Instant(t) as instant:
+        try: pf, gd, result = M.EvalGD(t, True, saveIm=True, p0=p0);
+        except RuntimeError: result = None;
+    last[:] = [t, result['params']] if result is not None else [None, None];
+    return (t, result, time.time() - start, instant.record,
+            render.Deferred());
 
 folder = raw_input('\nPath of folder to send file results: ');
 file_name = raw_input('\nFile name to record results: ');
@@ -31,31 +96,51 @@ file_name = raw_input('\nFile name to record results: ');
 t1 = float(sys.argv[2]);
 t2 = float(sys.argv[3]);
 dt = float(sys.argv[4]);
+workers = int(sys.argv[5]) if len(sys.argv) > 5 else 1;
 M  = sa.SF_analysis(int(sys.argv[1]), folder);
+ml.LoadLibrary(M.PF * 1E9);     # before fork, workers share it.
 
-f = open(M.path + file_name, 'w');
+store = ss.ScanStore(M.path + 'scan/', M.SD.shot_number);
 
 # Warning when do not 
 war_msg = '\nParametros para o instante %.3f nao encontrado.'
 war_msg = war_msg + ' Maximo de tentativas excedido!'
 
-for t in arange(t1, t2, dt):
-    print '\nInstante = %.3fms' %t;
-    try: pf, gd, result = M.EvalGD(t, True, saveIm=True);
-    except RuntimeError: print war_msg; continue;
-    # Extract useful results.
-    params = result['params'];
-    mcov   = result['mcov'];
-    n0_sig = sqrt(mcov[0][0]);
-    A_sig  = sqrt(mcov[2][2]);
-    n_max  = params[0] * (1 + params[2]**2);
-    # Estimate uncertain by covariance matrix.
-    der_n0 = (1 + params[2]**2);
-    der_A  = params[0] * (2 * params[2]);
-    sigma  = sqrt((der_n0 * n0_sig)**2 + (der_A * A_sig)**2);
-    # Record result.
-    f.write('%f' %t);
-    f.write('\t' + str(n_max));
-    f.write('\t' + str(sigma));
-    f.write('\n');
-f.close()
+times = [t for t in arange(t1, t2, dt) if not store.Has(t)];
+skipped = len(arange(t1, t2, dt)) - len(times);
+if skipped: print '\n%d instants already in %s, skipped.' % (skipped,
+                                                            store.folder)
+nfev = njev = warm = fails = 0;
+if workers > 1:
+    # Neighbour instants to the same worker, they share sweep spectra.
+    pool = Pool(workers, render.Defer);
+    chunk = max(1, len(times) // (4 * workers));
+    results = pool.imap(FitInstant, times, chunk);
+else:
+    results = (FitInstant(t) for t in times);
+render.Start(max(1, workers // 2));
+
+for t, result, seconds, record, figures in results:
+    # Records and figures of other processes are joined here.
+    if report and workers > 1: ins.Add(record);
+    render.Submit(figures);
+    # Record result (or the failure), on disk before the next one.
+    store.Append(t, result, seconds);
+    if result is None:
+        print war_msg % t;
+        fails += 1;
+        continue;
+    nfev += result['nfev'];
+    njev += result['njev'];
+    warm += result['warm'];
+
+if workers > 1:
+    pool.close();
+    pool.join();
+store.Export(M.path + file_name, t1, t2 - 0.5 * dt);
+store.Close();
+done, failed = render.Stop();
+if failed: print '\n%d figures not rendered.' % failed;
+print '\n%d fits (%d warm started), %d failed. Evaluations: %d of model,' \
+      ' %d of jacobian.' % (len(times) - fails, warm, fails, nfev, njev)
+if report: ins.Dump(report);